@@ -0,0 +1,82 @@
+#!/bin/python3
+
+"""Client of a multiplex service (multiplex.py --serve)
+
+Kept apart from multiplex_impl, with only the imports of the client, so
+the command line forwards to a running service without loading multiplex.
+"""
+
+import json
+import os
+import struct
+import sys
+
+# unix socket of a running --serve service, used by the command line
+SERVICE_ENV = "MULTIPLEX_SOCKET"
+# frames of a service response: channel, payload length
+SERVICE_FRAME = struct.Struct("!cI")
+# exit code of a service failure, also the one of multiplex_impl
+EC_SERVICE_FAIL=11
+# shortest abbreviation of --serve taken by the command line (argparse
+# prefixes), --se being shared by no other option
+SERVE_PREFIX = "--se"
+
+def call_service(socket_path, argv, stdout = None, stderr = None):
+    """Run a command line on a service, return its exit code
+
+    The output of the command line is written to the binary streams stdout
+    and stderr (the ones of the process by default). Returns None if no
+    service answers on the socket.
+    """
+    import socket
+
+    stdout = stdout or sys.stdout.buffer
+    stderr = stderr or sys.stderr.buffer
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+    with sock, sock.makefile('rb') as response:
+        request = { "argv": argv, "cwd": os.getcwd() }
+        try:
+            sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            while True:
+                header = response.read(SERVICE_FRAME.size)
+                if len(header) < SERVICE_FRAME.size:
+                    break
+                channel, size = SERVICE_FRAME.unpack(header)
+                payload = response.read(size)
+                if len(payload) < size:
+                    break
+                if channel == b'x':
+                    stdout.flush()
+                    return struct.unpack("!i", payload)[0]
+                (stdout if channel == b'o' else stderr).write(payload)
+        except OSError:
+            pass
+    stderr.write(b"The multiplex service closed the connection.\n")
+    return EC_SERVICE_FAIL
+
+def starts_service(argv):
+    """Return True if a command line starts a service: --serve, --serve=PATH
+    or an abbreviation of --serve"""
+    for arg in argv:
+        if arg == "--":
+            break
+        option = arg.split("=", 1)[0]
+        if len(option) >= len(SERVE_PREFIX) and "--serve".startswith(option):
+            return True
+    return False
+
+def forward(argv):
+    """Run a command line on the service of SERVICE_ENV, if any
+
+    Returns its exit code, None when it is to run in this process: no
+    service set or answering, or the command line starts a service.
+    """
+    service = os.environ.get(SERVICE_ENV)
+    if not service or starts_service(argv):
+        return None
+    return call_service(service, argv)
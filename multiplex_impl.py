@@ -0,0 +1,3472 @@
+#!/bin/python3
+
+import json
+import argparse
+import copy
+import traceback
+import os
+import sys
+import logging
+import re
+import itertools
+import functools
+import math
+import operator
+import heapq
+import hashlib
+import bisect
+import io
+import struct
+import contextlib
+import stat
+import time
+
+from collections import defaultdict
+from collections import OrderedDict
+from fractions import Fraction
+from array import array
+
+from multiplex_client import EC_SERVICE_FAIL, SERVICE_ENV, SERVICE_FRAME, \
+    call_service
+
+EC_SUCCESS=0
+EC_SCHEMA_FAIL=1
+EC_JSON_FAIL=2
+EC_REQUIREMENTS_FAIL=3
+EC_VALIDATIONS_FAIL=4
+EC_REQ_SCHEMA_FAIL=5
+EC_EMPTY_SET_FAIL=6
+EC_OUTPUT_WRITE_FAIL=7
+EC_MAX_COMBINATIONS_FAIL=8
+EC_LINKS_FAIL=9
+EC_COMPLETED_FAIL=10
+# EC_SERVICE_FAIL=11 comes with the client, which runs without this module
+EC_UNEXPECTED_FAIL=12
+
+class MultiplexError(Exception):
+    """Error of a multiplex run, with the exit code of the command line"""
+    exit_code = EC_VALIDATIONS_FAIL
+
+class SchemaError(MultiplexError):
+    """The input does not match the input schema"""
+    exit_code = EC_SCHEMA_FAIL
+
+class RequirementsSchemaError(MultiplexError):
+    """The requirements do not match the requirements schema"""
+    exit_code = EC_REQ_SCHEMA_FAIL
+
+class ParamValidationError(MultiplexError):
+    """A param val does not pass the requirements validations"""
+    exit_code = EC_VALIDATIONS_FAIL
+
+class EmptySetError(MultiplexError):
+    """A set has no params after the presets override"""
+    exit_code = EC_EMPTY_SET_FAIL
+
+class OutputWriteError(MultiplexError):
+    """The output can not be written"""
+    exit_code = EC_OUTPUT_WRITE_FAIL
+
+class LinksError(MultiplexError):
+    """The links of a set are invalid"""
+    exit_code = EC_LINKS_FAIL
+
+class ServiceError(MultiplexError):
+    """The service can not be started on its socket"""
+    exit_code = EC_SERVICE_FAIL
+
+class UncompiledSchemaError(Exception):
+    """A schema uses keywords compile_schema() does not support, to be
+    checked by jsonschema instead"""
+
+class OutputIndexError(MultiplexError):
+    """An output index is invalid, or does not match its output"""
+    exit_code = EC_OUTPUT_WRITE_FAIL
+
+validation_dict = {}
+convert_dict = {}
+transform_dict = {}
+presets_dict = {}
+
+# memoized (param, val) transformations per requirements
+TRANSFORM_CACHE_SIZE = 65536
+
+RE_ANCHORED_LITERAL = re.compile(r'^\^([\w ,:/=@%-]*)\$$')
+RE_BACKREF = re.compile(r'\\[1-9]|\(\?P=')
+
+# a number followed by an optional unit, e.g. '64', '1.5K' or '.5M'
+RE_UNIT_VAL = re.compile(r'^([0-9]*\.?[0-9]+|[0-9]+\.)([a-zA-Z]*)$')
+# units expressions, e.g. '1024*1024' or '1/1024/1024'
+RE_FACTOR_TOKEN = re.compile(r'(\s*([*/]?)\s*([0-9]*\.?[0-9]+)\s*)')
+# vals lists converted in one pass instead of value by value
+BATCH_TRANSFORM_MIN = 64
+
+# set-level keys of the input sets, besides the params
+SET_OPTIONS = ( "strategy", "t-wise", "constraints", "links" )
+# strength of the covering array per strategy (None: full cartesian product)
+STRATEGIES = { "full": None, "pairwise": 2 }
+# orders of the combinations of each set
+ORDERS = ( "product", "gray", "greedy" )
+# operands and operators of the run cost expressions
+RE_COST_EXPR = re.compile(r'\s*([*/])\s*')
+# statuses of the completed combinations in a --completed manifest
+COMPLETED_STATUSES = ( "completed", "done", "ok", "pass", "success" )
+# combinations the greedy order looks ahead for the cheapest change
+GREEDY_WINDOW = 64
+# numeric comparisons of the constraint conditions
+CONSTRAINT_OPS = { "lt": operator.lt, "le": operator.le,
+                   "gt": operator.gt, "ge": operator.ge }
+# compiled requirements and schemas kept by a process (e.g. --serve)
+MULTIPLEXER_CACHE_SIZE = 16
+SCHEMA_CACHE_SIZE = 8
+# directory of the on-disk cache of compiled requirements (empty: disabled),
+# $XDG_CACHE_HOME/multiplex by default
+CACHE_ENV = "MULTIPLEX_CACHE_DIR"
+# format of the compiled requirements of the cache
+CACHE_VERSION = 1
+# entries (compiled requirements and input markers) kept in the cache, the
+# least recently used ones evicted past it or unused for CACHE_MAX_AGE
+CACHE_MAX_ENTRIES = 256
+CACHE_MAX_AGE = 30 * 24 * 3600
+
+# --format of the output: json array (indented or compact), one json
+# combination per line, or a header of the params and rows of their vals
+OUTPUT_FORMATS = ( "readable", "compact", "ndjson", "columnar" )
+
+# --gzip compression level and write buffer: at the default level 9 the
+# outputs are about a quarter smaller, but compress several times slower
+GZIP_LEVEL = 6
+GZIP_BUFFER = 1 << 20
+
+# header of an output index (--index): magic, combinations and size of the
+# output, followed by the start and end offsets of each combination
+INDEX_MAGIC = b"MPLXIDX1"
+INDEX_HEADER = struct.Struct("<8sQQ")
+INDEX_ENTRY = struct.Struct("<QQ")
+
+# combinations of an input under which its sets are expanded serially, and
+# combinations dumped per task when they are expanded by --jobs processes
+PARALLEL_MIN_COMBINATIONS = 20000
+PARALLEL_CHUNK = 2048
+
+# --partitions outputs open at once, each pass over the combinations
+# writing as many of them
+PARTITION_OUTPUTS = 256
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s:  %(message)s'
+
+log = logging.getLogger(__name__)
+
+def process_options(argv = None):
+    """Process arguments from command line"""
+    parser = argparse.ArgumentParser(
+        description = 'Translate a JSON with multi-value parameters into a'
+                      'JSON with single-value parameters')
+
+    inputs = parser.add_mutually_exclusive_group()
+    inputs.add_argument('--input',
+                        dest = 'inputs',
+                        help = 'JSON file with multi-value parameters (default: '
+                               'mv-params.json); several files are multiplexed '
+                               'in parallel, as a batch',
+                        nargs = '+',
+                        type = str)
+
+    inputs.add_argument('--manifest',
+                        help = 'JSON file listing the inputs of a batch, with '
+                               'their requirements and output files',
+                        type = str)
+
+    parser.add_argument('--requirements',
+                        dest = 'req',
+                        help = 'JSON file with validation and transformation requirements',
+                        type = str)
+
+    parser.add_argument('--output',
+                        dest = 'output',
+                        help = 'JSON output file with single-value parameters',
+                        type = str)
+
+    parser.add_argument('--dry-run',
+                        dest = 'dry_run',
+                        action = 'store_true',
+                        help = 'Print the combination counts per set, the params '
+                               'multiplying them the most and the estimated '
+                               'output size, without expanding the sets')
+
+    parser.add_argument('--count',
+                        action = 'store_true',
+                        help = 'Print the total number of combinations, without '
+                               'expanding the sets')
+
+    parser.add_argument('--max-combinations',
+                        dest = 'max_combinations',
+                        help = 'Fail before any expansion if the input has more '
+                               'combinations than this budget',
+                        type = int)
+
+    strategy = parser.add_mutually_exclusive_group()
+    strategy.add_argument('--strategy',
+                          help = 'Combination strategy for all the sets, overriding '
+                                 'the sets strategy: full cartesian product or '
+                                 'pairwise covering array',
+                          choices = list(STRATEGIES))
+
+    strategy.add_argument('--t-wise',
+                          dest = 't_wise',
+                          help = 'Use a covering array of strength T for all the '
+                                 'sets: every combination of vals of any T params '
+                                 'is in at least one combination',
+                          type = int)
+
+    parser.add_argument('--format',
+                        help = 'Output format: indented json (default), compact '
+                               'json, one json combination per line (ndjson), or '
+                               'a header of the params and rows of their vals '
+                               '(columnar)',
+                        choices = OUTPUT_FORMATS,
+                        default = "readable")
+
+    parser.add_argument('--gzip',
+                        action = 'store_true',
+                        help = 'Compress the output with gzip')
+
+    parser.add_argument('--index',
+                        action = 'store_true',
+                        help = 'Write the offsets of the combinations next to the '
+                               'output (OUTPUT.idx), for IndexedOutput to read '
+                               'any of them without parsing the others')
+
+    parser.add_argument('--dedup',
+                        action = 'store_true',
+                        help = 'Drop the combinations identical to a previous one '
+                               '(same params and vals, in any order), reporting '
+                               'the duplicates of each set')
+
+    parser.add_argument('--ids',
+                        help = 'Write the stable content ID of each output '
+                               'combination to a file, one per line in the output '
+                               'order',
+                        type = str)
+
+    parser.add_argument('--completed',
+                        help = 'Skip the completed combinations: a file with '
+                               'their IDs (one per line, optionally followed by a '
+                               'status, e.g. as written by --ids) or a previous '
+                               'json output',
+                        type = str)
+
+    parser.add_argument('--order',
+                        help = 'Order of the combinations of each set: product '
+                               'order, or the order lowering the cost of changing '
+                               'param vals between runs (change-cost in the '
+                               'requirements validations)',
+                        choices = ORDERS,
+                        default = "product")
+
+    selection = parser.add_mutually_exclusive_group()
+    selection.add_argument('--shard',
+                           help = 'Only output the i-th of N balanced slices of '
+                                  'the combinations, e.g. 2/4',
+                           type = shard_option)
+
+    selection.add_argument('--range',
+                           dest = 'index_range',
+                           help = 'Only output the combinations with index from '
+                                  'start (included) to end (excluded), e.g. '
+                                  '100:200, 100: or :200',
+                           type = range_option)
+
+    selection.add_argument('--partitions',
+                           help = 'Split the combinations into N partitions of '
+                                  'balanced run cost (run-cost in the requirements), '
+                                  'written to N outputs named after --output, e.g. '
+                                  'bench-params-1.json',
+                           type = int)
+
+    parser.add_argument('--jobs',
+                        help = 'Processes multiplexing the inputs of a batch '
+                               '(default: the number of CPUs), or expanding the '
+                               'sets of a big input (default: 1)',
+                        type = int)
+
+    parser.add_argument('--no-cache',
+                        dest = 'no_cache',
+                        action = 'store_true',
+                        help = 'Do not use the on-disk cache of compiled '
+                               'requirements (%s)' % CACHE_ENV)
+
+    parser.add_argument('--trusted',
+                        action = 'store_true',
+                        help = 'Skip the schema validation of an input validated '
+                               'before (same contents), remembered in the '
+                               'requirements cache')
+
+    parser.add_argument('--serve',
+                        metavar = 'SOCKET',
+                        help = 'Run as a service on this unix socket, keeping '
+                               'the compiled requirements and schemas between '
+                               'requests; the command line uses it when %s is '
+                               'set to the socket' % SERVICE_ENV,
+                        type = str)
+
+    parser.add_argument('--debug',
+                        action = 'store_true',
+                        help = 'Print debug messages to stderr')
+
+    args = parser.parse_args(argv)
+    if args.inputs is None:
+        args.inputs = [ 'mv-params.json' ]
+    args.input = args.inputs[0]
+    if args.partitions is not None:
+        if args.partitions < 1:
+            parser.error("--partitions must be at least 1")
+        if args.output is None and not (args.dry_run or args.count):
+            parser.error("--partitions requires --output")
+    if args.t_wise is not None and args.t_wise < 1:
+        parser.error("--t-wise must be at least 1")
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.manifest is not None or len(args.inputs) > 1:
+        for option in [ "ids", "completed", "partitions" ]:
+            if getattr(args, option) is not None:
+                parser.error("--%s is not supported in batches" % option)
+    if args.gzip and args.output is None and (args.manifest is not None or
+                                              len(args.inputs) > 1):
+        parser.error("--gzip requires --output in batches")
+    if args.index:
+        if args.gzip:
+            parser.error("--index is not supported with --gzip")
+        if args.output is None and args.manifest is None and \
+                not (args.dry_run or args.count):
+            parser.error("--index requires --output")
+    if len(args.inputs) > 1 and args.output is not None:
+        # the outputs are named after the inputs, in the --output directory
+        if not os.path.isdir(args.output):
+            parser.error("--output must be a directory with several inputs")
+        names = [ os.path.basename(path) for path in args.inputs ]
+        if len(set(names)) != len(names):
+            parser.error("several inputs have the same file name, use a "
+                         "--manifest to name their outputs")
+    return args
+
+def shard_option(value):
+    """Parse a --shard i/N option"""
+    match = re.fullmatch(r'([0-9]+)/([0-9]+)', value)
+    if match is None or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise argparse.ArgumentTypeError("invalid shard '%s', expected i/N with"
+                                         " 1 <= i <= N" % value)
+    return (int(match.group(1)), int(match.group(2)))
+
+def range_option(value):
+    """Parse a --range start:end option"""
+    match = re.fullmatch(r'([0-9]*):([0-9]*)', value)
+    if match is None:
+        raise argparse.ArgumentTypeError("invalid range '%s', expected "
+                                         "start:end" % value)
+    return tuple(int(v) if v else None for v in match.groups())
+
+def dump_json(obj, format = 'readable'):
+    """Dump json in readable or parseable format"""
+    # Parseable format has no indentation
+    indentation = None
+    sep = ':'
+    if format == 'readable':
+        indentation = 4
+        sep += ' '
+
+    return json.dumps(obj, indent = indentation, separators = (',', sep),
+                      sort_keys = True)
+
+def dump_json_element(item, format = 'readable'):
+    """Dump an element of a json array, as nested in dump_json() of the array"""
+    text = dump_json(item, format)
+    if format == 'readable':
+        # nest the element one level deeper inside the array
+        text = '    ' + text.replace('\n', '\n    ')
+    return text
+
+def array_framing(format = 'readable'):
+    """Return the opening, separator, closing and empty form of a json array"""
+    if format == 'readable':
+        return '[\n', ',\n', '\n]', '[]'
+    return '[', ',', ']', '[]'
+
+def dump_json_stream(iterable, output_fp, format = 'readable'):
+    """Write a json array incrementally, one element at a time
+
+    The result is byte-for-byte identical to dump_json() on the equivalent
+    list, but the array is never held in memory as a whole.
+    """
+    dump_json_chunks((dump_json_element(item, format) for item in iterable),
+                     output_fp, array_framing(format))
+
+def dump_json_chunks(chunks, output_fp, framing = None, offsets = None):
+    """Write an output from non-empty chunks of dumped elements
+
+    Each chunk holds consecutive elements joined by the separator of the
+    framing (opening, separator, closing, empty output), a json array of
+    elements dumped by dump_json_element() by default. The start and end
+    of each chunk in the output are appended to offsets, if given.
+    """
+    opening, sep, closing, empty = framing or array_framing()
+    if offsets is not None:
+        chunks = chunk_offsets(chunks, offsets, len(opening), len(sep))
+    chunks = iter(chunks)
+    # pull the first chunk before writing anything, so an error raised
+    # while generating it leaves no partial output behind
+    try:
+        first = next(chunks)
+    except StopIteration:
+        output_fp.write(empty)
+        return
+
+    output_fp.write(opening)
+    output_fp.write(first)
+    for chunk in chunks:
+        output_fp.write(sep)
+        output_fp.write(chunk)
+    output_fp.write(closing)
+
+def chunk_offsets(chunks, offsets, position, sep_size):
+    """Yield chunks, appending their start and end positions to offsets"""
+    # the dumps are ascii (json.dumps escapes the rest), so the length of
+    # a chunk is its size in bytes
+    for chunk in chunks:
+        offsets.append(position)
+        position += len(chunk)
+        offsets.append(position)
+        position += sep_size
+        yield chunk
+
+def is_enabled(obj):
+    """Return True if a set or param is enabled, without changing it"""
+    return obj.get("enabled", "yes").lower() != "no"
+
+def param_enabled(param_obj):
+    """Return True if param is enabled, False otherwise"""
+    enabled=True
+    if "enabled" in param_obj:
+        if param_obj['enabled'].lower() == "no":
+            enabled=False
+        del param_obj["enabled"]
+    return enabled
+
+class ValMatcher:
+    """Compiled validation patterns of a param"""
+    __slots__ = ('patterns', 'literals', 'regexes')
+
+    def __init__(self, patterns):
+        self.patterns = patterns
+        # anchored literal patterns (e.g. '^fio$' or '^sync$|^libaio$') are
+        # checked with a set lookup instead of a regex
+        self.literals = set()
+        regexes = []
+        for pattern in patterns:
+            literals = anchored_literals(pattern)
+            if literals is None:
+                regexes.append(pattern)
+            else:
+                self.literals.update(literals)
+
+        # merge the remaining patterns into a single regex, unless they use
+        # backreferences, which would be renumbered by the merge
+        self.regexes = []
+        if len(regexes) > 1 and not any(RE_BACKREF.search(p) for p in regexes):
+            try:
+                self.regexes = [ re.compile('|'.join('(?:%s)' % p
+                                                     for p in regexes)) ]
+            except re.error:
+                pass
+        if not self.regexes:
+            self.regexes = [ re.compile(p) for p in regexes ]
+
+    def match(self, val):
+        """Return True if val matches any of the patterns"""
+        # '$' also matches right before a trailing newline
+        if val in self.literals or (val.endswith('\n') and
+                                    val[:-1] in self.literals):
+            return True
+        for regex in self.regexes:
+            if regex.match(val) is not None:
+                return True
+        return False
+
+def anchored_literals(pattern):
+    """Return the literals of a '^lit$[|^lit$...]' pattern, None otherwise"""
+    literals = []
+    for alternative in pattern.split('|'):
+        literal = RE_ANCHORED_LITERAL.match(alternative)
+        if literal is None:
+            return None
+        literals.append(literal.group(1))
+    return literals
+
+class UnitConverter:
+    """Conversion of vals (or val ranges) to a target unit"""
+    __slots__ = ('target', 'factors')
+
+    def __init__(self, target, units):
+        self.target = target
+        # factor table: unit -> exact rational factor to the target unit
+        self.factors = {}
+        for unit, expr in units.items():
+            factor = parse_factor(str(expr))
+            if factor is None:
+                log.error("Invalid conversion expression '%s' for unit '%s'."
+                          " Only numbers, '*' and '/' are supported."
+                          % (expr, unit))
+            else:
+                self.factors[unit] = factor
+
+    def convert(self, val):
+        """Convert a val, or a 'low-high' val range, to the target unit"""
+        vals = []
+        for v in val.split('-'):
+            token = RE_UNIT_VAL.match(v)
+            _unit = v if token is None else token.group(2)
+
+            if token is not None and _unit in self.factors:
+                _val = Fraction(token.group(1)) * self.factors[_unit]
+                if _val.denominator == 1:
+                    _val = _val.numerator
+                else:
+                    _val = float(_val)
+                vals.append(str(_val) + self.target)
+            else:
+                log.warning("Unit %s has not been found in `units`" % _unit)
+        if len(vals) > 0:
+            val = vals[0]
+        if len(vals) > 1:
+            val = val + "-" + vals[1]
+        return val
+
+    def convert_all(self, vals):
+        """Convert a list of vals to the target unit"""
+        convert = self.convert
+        return [ convert(val) for val in vals ]
+
+@functools.lru_cache(maxsize=None)
+def parse_factor(expr):
+    """Parse a 'a*b/c' units expression into a Fraction, None if invalid"""
+    tokens = RE_FACTOR_TOKEN.findall(expr)
+    # the tokens must cover the whole expression: number (op number)*
+    if (len(tokens) == 0 or "".join(t[0] for t in tokens) != expr or
+            tokens[0][1] != '' or any(t[1] == '' for t in tokens[1:])):
+        return None
+
+    factor = Fraction(1)
+    for _, op, num in tokens:
+        if op == '/':
+            if Fraction(num) == 0:
+                return None
+            factor /= Fraction(num)
+        else:
+            factor *= Fraction(num)
+    return factor
+
+class ParamTransformer:
+    """Validation, conversion and transformation compiled from requirements"""
+
+    def __init__(self, validations, conversions, transforms):
+        self.validation_dict = validations
+        self.convert_dict = conversions
+        self.transform_dict = transforms
+
+        self.matchers = {}
+        for param, pattern_array in validations.items():
+            # backwards compatibility (validation regex as str, not an array)
+            if isinstance(pattern_array, str):
+                pattern_array = [pattern_array]
+            self.matchers[param] = ValMatcher(tuple(pattern_array))
+
+        # unit expressions parsed into exact factors, per target unit
+        self.converters = {}
+        for param, conversion in conversions.items():
+            _convert = next(iter(conversion))
+            self.converters[param] = UnitConverter(_convert, conversion[_convert])
+
+        self.transforms = {}
+        for param, transform in transforms.items():
+            if "search" not in transform or "replace" not in transform:
+                continue
+            try:
+                self.transforms[param] = (re.compile(transform["search"]),
+                                          transform["replace"])
+            except re.error:
+                log.exception("Invalid regex for search/replace.")
+
+        # the same (param, val) pairs repeat across sets and global includes
+        self.transform = functools.lru_cache(maxsize=TRANSFORM_CACHE_SIZE)(
+            self._transform)
+
+    def uses(self, validations, conversions, transforms):
+        """Return True if compiled from these requirements dicts"""
+        return (self.validation_dict is validations and
+                self.convert_dict is conversions and
+                self.transform_dict is transforms)
+
+    def validated(self, param, val):
+        """Return True if matches validation pattern, False otherwise"""
+
+        # if validation dict is empty, no requirements are in place, then pass
+        if len(self.validation_dict) == 0:
+            return True
+
+        if param in self.matchers:
+            matcher = self.matchers[param]
+            if matcher.match(val):
+                return True
+            for pattern in matcher.patterns:
+                log.warning("Validation failed for param='%s', "
+                            "val='%s'. Values didn't match the pattern '%s'."
+                            % (param, val, pattern))
+        else:
+            log.error("Validation for param='%s' not found in the "
+                      "requirements file." % param)
+        return False
+
+    def transform_vals(self, param, vals):
+        """Param validation, transformation and conversion of a vals list"""
+        if len(vals) < BATCH_TRANSFORM_MIN:
+            return [ self.transform(param, val) for val in vals ]
+
+        # big vals lists: one pass per step over the whole list, bypassing
+        # the memo (which would be flushed by the list itself anyway)
+        if bool(self.validation_dict):
+            for val in vals:
+                if not self.validated(param, val):
+                    raise ParamValidationError(
+                        "Validation failed for param '%s', val '%s'"
+                        % (param, val))
+
+        if param in self.converters:
+            vals = self.converters[param].convert_all(vals)
+
+        if param in self.transforms:
+            _search, _replace = self.transforms[param]
+            try:
+                vals = [ _search.sub(_replace, val) for val in vals ]
+            except re.error:
+                log.exception("Invalid regex for search/replace.")
+        return list(vals)
+
+    def _transform(self, param, val):
+        """Param validation, transformation and conversion"""
+        # check if param passes validation pattern
+        if bool(self.validation_dict):
+            if not self.validated(param, val):
+                raise ParamValidationError(
+                    "Validation failed for param '%s', val '%s'"
+                    % (param, val))
+
+        if param in self.converters:
+            val = self.converters[param].convert(val)
+
+        if param in self.transforms:
+            _search, _replace = self.transforms[param]
+            try:
+                val = _search.sub(_replace, val)
+            except re.error:
+                log.exception("Invalid regex for search/replace.")
+        return val
+
+_transformer = None
+
+def param_transformer():
+    """Return the transformer compiled from the requirements dicts"""
+    global _transformer
+    if (_transformer is None or
+            not _transformer.uses(validation_dict, convert_dict, transform_dict)):
+        _transformer = ParamTransformer(validation_dict, convert_dict,
+                                        transform_dict)
+    return _transformer
+
+def param_validated(param, val):
+    """Return True if matches validation pattern, False otherwise"""
+    return param_transformer().validated(param, val)
+
+def load_param_sets(sets_block, set_options = None, presets = None):
+    """Load params from sets block
+
+    If a set_options list is given, the set-level options (e.g. strategy) of
+    each loaded set are appended to it, in the same order as the sets. The
+    named presets default to the ones loaded by load_presets(). The sets
+    block is not modified.
+    """
+    if presets is None:
+        presets = presets_dict
+
+    # mv_array (multi-value) is an array of param set arrays
+    mv_array = []
+
+    if len(sets_block) == 0 or "sets" not in sets_block:
+        return mv_array
+
+    # global-options blocks by name, and the params of each include or
+    # include-preset resolved once, then shared by all the sets including
+    # them (they must not be modified, see sanitize_set)
+    global_opts = defaultdict(list)
+    for global_opt in sets_block.get('global-options', []):
+        global_opts[global_opt['name']].append(global_opt)
+    resolved_globals = {}
+    resolved_presets = {}
+
+    for set in sets_block['sets']:
+        # params indexed by (arg, role, id), kept in insertion order so that
+        # overriding a param keeps its position in the set
+        param_set = {}
+
+        if not is_enabled(set):
+            # ignore this set if enabled=no
+            continue
+
+        # handle global params included in each set
+        if 'include' in set:
+            include_set = set['include']
+            # include may be a string or array, normalize it to array
+            if isinstance(include_set, str):
+                include_set = [ include_set ]
+            for inc in include_set:
+                if inc not in resolved_globals:
+                    # Go find set of params in global options block
+                    params = []
+                    for global_opt in global_opts.get(inc, []):
+                        params += global_opt['params']
+                    resolved_globals[inc] = resolve_params(params)
+                for gp in resolved_globals[inc]:
+                    # only include if param is not defined in this set
+                    param_set.setdefault(param_key(gp), gp)
+
+        # handle named presets params included in each set
+        if 'include-preset' in set:
+            preset = set['include-preset']
+            # Include params if named-preset group is found
+            if preset in presets:
+                if preset not in resolved_presets:
+                    resolved_presets[preset] = resolve_params(
+                        presets[preset])
+                for pp in resolved_presets[preset]:
+                    # only include if param is not defined in this set
+                    param_set.setdefault(param_key(pp), pp)
+
+        # handle params in each set
+        if 'params' in set:
+            for param in set['params']:
+                if is_enabled(param):
+                    if "enabled" in param:
+                        param = { k: v for k, v in param.items()
+                                  if k != "enabled" }
+                    # override (in place) or append
+                    param_set[param_key(param)] = param
+
+        # mv_array is the outter array containing the inner sets
+        mv_array.append(list(param_set.values()))
+        if set_options is not None:
+            set_options.append({ k: set[k] for k in SET_OPTIONS if k in set })
+
+    return mv_array
+
+def resolve_params(params):
+    """Return copies of the enabled params, without the enabled key"""
+    resolved = []
+    for param in params:
+        p = copy.deepcopy(param)
+        if param_enabled(p):
+            resolved.append(p)
+    return resolved
+
+def sanitize_set(obj):
+    """Update set with roles and remove disabled params or entire set"""
+
+    result = []
+    for param in obj:
+        if not param_enabled(param):
+            continue
+
+        # default to client role if not specified; params may be shared
+        # by several sets, so copy instead of updating them in place
+        if "role" not in param:
+            param = dict(param, role = "client")
+
+        result.append(param)
+
+    return result
+
+def transform_param_val(param, val):
+    """Param validation, transformation and conversion"""
+    return param_transformer().transform(param, val)
+
+def canonical_param(param):
+    """Canonical form of a single-value param, with the role/id defaults"""
+    param = dict(param, role = param.get('role') or "client",
+                 id = param.get('id') or "1")
+    return json.dumps(param, separators = (',', ':'), sort_keys = True)
+
+def canonical_hash(canonical_params):
+    """Hash the canonical forms of the params of a combination, in any order"""
+    digest = hashlib.blake2b("\n".join(sorted(canonical_params)).encode(),
+                             digest_size = 8).digest()
+    return int.from_bytes(digest, "big")
+
+def combination_hash(params):
+    """Return the 64-bit canonical hash of a single-value param set
+
+    The hash does not depend on the order of the params, nor on the role
+    and id being omitted or set to their defaults.
+    """
+    return canonical_hash([ canonical_param(param) for param in params ])
+
+class ParamRecord:
+    """A param of a set, shared by every combination built from that set"""
+    __slots__ = ('keys', 'vals', 'canonical')
+
+    def __init__(self, param, vals):
+        # every key but vals (arg, role, id, ...) is kept as is
+        self.keys = { k: v for k, v in param.items() if k != 'vals' }
+        # transformed vals, addressed by index from the combinations
+        self.vals = tuple(vals)
+        # canonical forms of the single-value params, built on first use
+        self.canonical = None
+
+    def canonical_param(self, val_idx):
+        """Return the canonical form of the single-value param of a val"""
+        if self.canonical is None:
+            self.canonical = [ canonical_param(self.single_value(val_idx))
+                               for val_idx in range(len(self.vals)) ]
+        return self.canonical[val_idx]
+
+    def single_value(self, val_idx):
+        """Return the single-value param dict for one of the vals"""
+        param = dict(self.keys)
+        param['val'] = self.vals[val_idx]
+        return param
+
+class Combination:
+    """One single-value set: a tuple of val indexes into the set records"""
+    __slots__ = ('records', 'idx')
+
+    def __init__(self, records, idx):
+        self.records = records
+        self.idx = idx
+
+    def to_dicts(self):
+        """Build the single-value param dicts of this combination"""
+        return [ record.single_value(val_idx)
+                 for record, val_idx in zip(self.records, self.idx) ]
+
+    def content_hash(self):
+        """Canonical hash of this combination, same as combination_hash()"""
+        return canonical_hash([ record.canonical_param(val_idx) for
+                                record, val_idx in zip(self.records, self.idx) ])
+
+    def content_id(self):
+        """Stable ID of this combination: its canonical hash in hex"""
+        return "%016x" % self.content_hash()
+
+class CompletedIds:
+    """IDs of the completed combinations, skipped in the output
+
+    The 64-bit IDs are kept in a sorted array and looked up by binary
+    search: 8 bytes per ID, and exact, unlike a Bloom filter whose false
+    positives would drop pending combinations.
+    """
+
+    def __init__(self, ids):
+        self.ids = array('Q', sorted(ids))
+        self.skipped = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, key):
+        pos = bisect.bisect_left(self.ids, key)
+        return pos < len(self.ids) and self.ids[pos] == key
+
+    def is_pending(self, combination):
+        """Return False if the combination is completed, counting it"""
+        if combination.content_hash() in self:
+            self.skipped += 1
+            return False
+        return True
+
+def output_combinations(output_fp):
+    """Yield the combinations, lists of single-value params, of a json
+    output in any --format"""
+    first = output_fp.readline()
+    try:
+        combination = json.loads(first)
+    except ValueError:
+        combination = None
+    if isinstance(combination, list) and len(combination) > 0 and \
+            all(isinstance(param, dict) for param in combination):
+        # ndjson, a combination per line
+        yield combination
+        for line in output_fp:
+            if line.strip():
+                yield json.loads(line)
+        return
+
+    output_fp.seek(0)
+    output = json.load(output_fp)
+    if isinstance(output, dict):
+        # columnar, null for the params not in a combination
+        columns = output["columns"]
+        for row in output["rows"]:
+            yield [ dict(keys, val = val) for keys, val in zip(columns, row)
+                    if val is not None ]
+        return
+    yield from output
+
+def load_completed(completed_file):
+    """Load the IDs of the completed combinations, None on failure
+
+    The file is either a manifest with an ID per line (as written by
+    --ids), optionally followed by a status, or a previous json output
+    (in any --format) whose combinations are all completed.
+    """
+    try:
+        with open(completed_file, "r", encoding = "utf-8") as manifest:
+            if manifest.read(4096).lstrip()[:1] in ('[', '{'):
+                manifest.seek(0)
+                try:
+                    return CompletedIds(combination_hash(params) for params
+                                        in output_combinations(manifest))
+                except (ValueError, TypeError, AttributeError, KeyError):
+                    log.exception("Invalid json output %s", completed_file)
+                    return None
+
+            manifest.seek(0)
+            ids = []
+            for line_nr, line in enumerate(manifest, start = 1):
+                fields = line.split()
+                if len(fields) == 0 or fields[0].startswith('#'):
+                    continue
+                try:
+                    key = int(fields[0], 16)
+                except ValueError:
+                    key = None
+                if key is None or len(fields[0]) != 16 or len(fields) > 2:
+                    log.error("Invalid line %d in the completed manifest %s:"
+                              " '%s'", line_nr, completed_file, line.rstrip())
+                    return None
+                if len(fields) == 1 or fields[1].lower() in COMPLETED_STATUSES:
+                    ids.append(key)
+    except OSError:
+        log.exception("Failed to read the completed manifest %s",
+                      completed_file)
+        return None
+    return CompletedIds(ids)
+
+class Deduplicator:
+    """Drop the combinations already seen, by canonical hash
+
+    Only the 64-bit hash of each unique combination is kept, and the
+    duplicates are counted for the set they come from.
+    """
+
+    def __init__(self, param_sets):
+        self.sets = { id(param_set.records): idx
+                      for idx, param_set in enumerate(param_sets) }
+        self.seen = set()
+        self.duplicates = [0] * len(param_sets)
+
+    def is_new(self, combination):
+        """Return False if the combination has been seen, counting it"""
+        key = combination.content_hash()
+        if key in self.seen:
+            self.duplicates[self.sets[id(combination.records)]] += 1
+            return False
+        self.seen.add(key)
+        return True
+
+    def skip(self, combinations):
+        """Mark combinations as seen, without counting their duplicates"""
+        for combination in combinations:
+            self.seen.add(combination.content_hash())
+
+class ParamSet:
+    """A multi-value set ready for expansion: its validated param records"""
+    __slots__ = ('records', 'links', 'rows', 'checks', 'gray', 'total')
+
+    def __init__(self, records, links = None, rows = None, checks = None):
+        self.records = records
+        # dimension of the product of each param (an itemgetter mapping the
+        # val indexes of the dimensions to the records), None if no params
+        # are linked and each param is a dimension
+        self.links = links
+        # val indexes of the selected combinations (e.g. a covering array),
+        # None for the full cartesian product
+        self.rows = rows
+        # constraint checks to run once the dimension at each position is
+        # set, None if the set is not constrained
+        self.checks = checks
+        # dimensions from the slowest to the fastest changing, when the
+        # full product is in reflected gray order
+        self.gray = None
+        self.total = None
+
+    def radices(self):
+        """Number of vals of each dimension, the digits of the mixed radix"""
+        if self.links is None:
+            return [ len(record.vals) for record in self.records ]
+        # the first param of each group of linked params
+        leaders = {}
+        for pos, dim in enumerate(self.links(range(len(self.records)))):
+            leaders.setdefault(dim, pos)
+        return [ len(self.records[pos].vals) for pos in leaders.values() ]
+
+    def record_idx(self, idx):
+        """Map the val indexes of the dimensions to the ones of the params"""
+        return idx if self.links is None else self.links(idx)
+
+    def selection(self):
+        """Val indexes of the selected combinations, None for the full product"""
+        if self.checks is not None:
+            selection = iter_constrained(self.radices(), self.checks)
+        elif self.rows is not None:
+            selection = self.rows
+        else:
+            return None
+        return selection if self.links is None else map(self.links, selection)
+
+    def count(self):
+        """Number of combinations, without expanding them"""
+        if self.total is None:
+            if self.rows is not None:
+                self.total = len(self.rows)
+            elif self.checks is not None:
+                self.total = sum(1 for _ in self.selection())
+            else:
+                self.total = math.prod(self.radices())
+        return self.total
+
+    def combination(self, k):
+        """Return the k-th combination of this set, without expansion"""
+        if self.rows is not None:
+            return Combination(self.records, self.record_idx(self.rows[k]))
+        if self.checks is not None:
+            for idx in itertools.islice(self.selection(), k, None):
+                return Combination(self.records, idx)
+            raise IndexError("combination index %d out of range" % k)
+        if self.gray is not None:
+            if k >= self.count():
+                raise IndexError("combination index %d out of range" % k)
+            return Combination(self.records, self.record_idx(
+                gray_decode(self.radices(), self.gray, k)))
+        return Combination(self.records,
+                           self.record_idx(decode_index(self.radices(), k)))
+
+    def combinations(self, start = 0, stop = None):
+        """Yield the combinations of this set, from start to stop"""
+        selection = self.selection()
+        if selection is not None:
+            return (Combination(self.records, idx) for idx in
+                    itertools.islice(selection, start, stop))
+        count = self.count()
+        if stop is None or stop > count:
+            stop = count
+        if self.gray is not None:
+            radices = self.radices()
+            return (Combination(self.records, self.record_idx(
+                        gray_decode(radices, self.gray, k)))
+                    for k in range(start, stop))
+        if start == 0 and stop == count and self.links is None:
+            return update_vals(self.records)
+        return (Combination(self.records, self.record_idx(idx)) for idx in
+                iter_index_range(self.radices(), start, stop))
+
+def link_params(records, links):
+    """Return the dimension of the product of each param of a set
+
+    Linked params are zipped, their vals paired position by position, and
+    form a single dimension; the dimensions are ordered by their first
+    param. Linked params missing from the set are ignored. An itemgetter
+    mapping the val indexes of the dimensions to the params is returned,
+    None when no params are linked.
+    """
+    positions = { param_key(record.keys): pos
+                  for pos, record in enumerate(records) }
+    leader = list(range(len(records)))
+    linked = set()
+    for link in links:
+        group = sorted(positions[key] for key in map(param_key, link)
+                       if key in positions)
+        if len(group) < 2:
+            continue
+        for pos in group:
+            if pos in linked:
+                log.error("Param '%s' is in more than one link.",
+                          records[pos].keys['arg'])
+                raise LinksError("Param '%s' is in more than one link"
+                                 % records[pos].keys['arg'])
+            if len(records[pos].vals) != len(records[group[0]].vals):
+                log.error("Linked params '%s' and '%s' do not have the same "
+                          "number of vals.", records[group[0]].keys['arg'],
+                          records[pos].keys['arg'])
+                raise LinksError("Linked params '%s' and '%s' do not have "
+                                 "the same number of vals"
+                                 % (records[group[0]].keys['arg'],
+                                    records[pos].keys['arg']))
+        linked.update(group)
+        for pos in group[1:]:
+            leader[pos] = group[0]
+
+    if not linked:
+        return None
+    dims = {}
+    for pos in leader:
+        dims.setdefault(pos, len(dims))
+    return operator.itemgetter(*[ dims[pos] for pos in leader ])
+
+def complete_constrained(radices, constraints, idx):
+    """Set the unset (None) val indexes of idx to pass the constraints
+
+    The constraints are (dimensions, check(idx)) tuples, as returned by
+    compile_constraint(). The constrained dimensions are searched by
+    backtracking, the others set to their first val. idx is completed in
+    place; False is returned, with idx unchanged, if no combination with
+    its set vals passes the constraints.
+    """
+    for dims, check in constraints:
+        if all(idx[dim] is not None for dim in dims) and not check(idx):
+            return False
+    free = sorted({ dim for dims, _ in constraints for dim in dims
+                    if idx[dim] is None })
+    # checks to run once the last of their unset dimensions is set
+    order = { dim: pos for pos, dim in enumerate(free) }
+    pending = [ [] for _ in free ]
+    for dims, check in constraints:
+        unset = [ order[dim] for dim in dims if dim in order ]
+        if unset:
+            pending[max(unset)].append(check)
+
+    def search(pos):
+        if pos == len(free):
+            return True
+        dim = free[pos]
+        for val in range(radices[dim]):
+            idx[dim] = val
+            if all(check(idx) for check in pending[pos]) and search(pos + 1):
+                return True
+        idx[dim] = None
+        return False
+
+    if not search(0):
+        return False
+    for dim, val in enumerate(idx):
+        if val is None:
+            idx[dim] = 0
+    return True
+
+def covering_array(radices, strength, constraints = ()):
+    """Return the rows of a covering array of the given strength (t)
+
+    Every combination of vals of any t params appears in at least one row.
+    The rows are built in-parameter-order (IPOG): the full product of the
+    first t params, then each other param is added by extending the rows
+    (horizontal growth) and adding rows for the tuples left uncovered
+    (vertical growth). Ties are broken by order, so the result is
+    deterministic. Returns None when the full product is needed anyway.
+
+    With constraints, as in complete_constrained(), the rows only get
+    vals they can be completed with into valid combinations: the t-tuples
+    no valid combination has are left out, and every other one is covered.
+    """
+    # single-val params do not change the coverage, always use val 0
+    cols = [ col for col, radix in enumerate(radices) if radix > 1 ]
+    if len(cols) <= strength:
+        return None
+    # params with the most vals first, for smaller arrays
+    cols.sort(key = lambda col: radices[col], reverse = True)
+    sizes = [ radices[col] for col in cols ]
+
+    def full_idx(row):
+        idx = [ 0 ] * len(radices)
+        for pos, col in enumerate(cols):
+            idx[col] = row[pos]
+        return idx
+
+    feasible_rows = {}
+    def feasible(row):
+        # whether a row (None for its don't cares) has a valid completion
+        if not constraints:
+            return True
+        key = tuple(row)
+        if key not in feasible_rows:
+            feasible_rows[key] = complete_constrained(radices, constraints,
+                                                      full_idx(row))
+        return feasible_rows[key]
+
+    rows = [ list(idx) + [None] * (len(cols) - strength) for idx in
+             itertools.product(*[ range(size) for size in sizes[:strength] ]) ]
+    rows = [ row for row in rows if feasible(row) ]
+
+    for col in range(strength, len(cols)):
+        size = sizes[col]
+        # t-tuples to cover: t-1 of the previous params plus this one, each
+        # tuple of vals flagged in a bytearray indexed by its mixed radix
+        groups = list(itertools.combinations(range(col), strength - 1))
+        uncovered = [ bytearray(b'\x01') * (math.prod(sizes[g] for g in group)
+                                            * size)
+                      for group in groups ]
+
+        def tuple_vals(group, index):
+            index, val = divmod(index, size)
+            vals = {}
+            for g in reversed(group):
+                index, vals[g] = divmod(index, sizes[g])
+            vals[col] = val
+            return vals
+
+        def assigned(row, vals):
+            row = list(row)
+            for g, v in vals.items():
+                row[g] = v
+            return row
+
+        if constraints:
+            # tuples of no valid combination: nothing to cover
+            empty = [None] * len(cols)
+            for group, flags in zip(groups, uncovered):
+                for index in range(len(flags)):
+                    if not feasible(assigned(empty, tuple_vals(group, index))):
+                        flags[index] = 0
+
+        def tuple_index(group, row):
+            index = 0
+            for g in group:
+                if row[g] is None:
+                    return None
+                index = index * sizes[g] + row[g]
+            return index * size
+
+        # horizontal growth: pick the val covering the most new tuples
+        for row in rows:
+            indexes = [ tuple_index(group, row) for group in groups ]
+            gains = [0] * size
+            for flags, index in zip(uncovered, indexes):
+                if index is not None:
+                    for val in range(size):
+                        gains[val] += flags[index + val]
+            best = None
+            for val in sorted(range(size), key = lambda val: -gains[val]):
+                if gains[val] == 0:
+                    break
+                if feasible(assigned(row, { col: val })):
+                    best = val
+                    break
+            if best is None:
+                # leave a don't care, for the vertical growth
+                continue
+            row[col] = best
+            for flags, index in zip(uncovered, indexes):
+                if index is not None:
+                    flags[index + best] = 0
+
+        # vertical growth: reuse rows with don't cares, or add new rows
+        for group, flags in zip(groups, uncovered):
+            for index in range(len(flags)):
+                if not flags[index]:
+                    continue
+                vals = tuple_vals(group, index)
+                for row in rows:
+                    if all(row[g] is None or row[g] == v
+                           for g, v in vals.items()) and \
+                            feasible(assigned(row, vals)):
+                        break
+                else:
+                    row = [None] * len(cols)
+                    rows.append(row)
+                for g, v in vals.items():
+                    row[g] = v
+
+    # map back to the params order, don't cares use the first val, or the
+    # first one of a valid combination
+    covering = []
+    for row in rows:
+        idx = full_idx(row)
+        complete_constrained(radices, constraints, idx)
+        covering.append(tuple(idx))
+    return covering
+
+def decode_index(radices, k):
+    """Decode a combination index into val indexes (mixed radix)"""
+    # the last param varies the fastest, as in itertools.product
+    idx = [0] * len(radices)
+    for pos in range(len(radices) - 1, -1, -1):
+        k, idx[pos] = divmod(k, radices[pos])
+    return tuple(idx)
+
+def iter_index_range(radices, start, stop):
+    """Yield the val indexes of the combinations from start to stop"""
+    idx = list(decode_index(radices, start))
+    for _ in range(start, stop):
+        yield tuple(idx)
+        # increment the mixed radix number
+        pos = len(radices) - 1
+        while pos >= 0:
+            idx[pos] += 1
+            if idx[pos] < radices[pos]:
+                break
+            idx[pos] = 0
+            pos -= 1
+
+def gray_decode(radices, order, k):
+    """Decode a combination index into val indexes in reflected gray order
+
+    The dimensions in order go from the slowest to the fastest changing,
+    and consecutive combinations differ in the val of a single dimension:
+    a dimension is swept back and forth instead of restarting from its
+    first val.
+    """
+    digits = [0] * len(order)
+    for i in range(len(order) - 1, -1, -1):
+        k, digits[i] = divmod(k, radices[order[i]])
+    idx = [0] * len(radices)
+    # the sweep of a dimension is reversed when the number formed by the
+    # digits of the slower dimensions is odd
+    odd = 0
+    for digit, pos in zip(digits, order):
+        idx[pos] = radices[pos] - 1 - digit if odd else digit
+        odd = (odd * radices[pos] + digit) % 2
+    return tuple(idx)
+
+def gray_rank(radices, order, idx):
+    """Return the index of val indexes in reflected gray order"""
+    k = 0
+    odd = 0
+    for pos in order:
+        digit = radices[pos] - 1 - idx[pos] if odd else idx[pos]
+        k = k * radices[pos] + digit
+        odd = (odd * radices[pos] + digit) % 2
+    return k
+
+def dim_costs(param_set, change_costs):
+    """Return the cost of changing the val of each dimension of a set"""
+    costs = [0] * len(param_set.radices())
+    dims = param_set.record_idx(range(len(param_set.records)))
+    for dim, record in zip(dims, param_set.records):
+        costs[dim] += change_costs.get(record.keys['arg'], 0)
+    return costs
+
+def sequence_cost(costs, rows):
+    """Total cost of the changes between consecutive val indexes"""
+    total = 0
+    previous = None
+    for idx in rows:
+        if previous is not None:
+            total += sum(cost for cost, a, b in zip(costs, previous, idx)
+                         if a != b)
+        previous = idx
+    return total
+
+def greedy_order(costs, rows, window = GREEDY_WINDOW):
+    """Order val indexes by nearest neighbor, the cheapest change first
+
+    The next row is the one the cheapest to change to among the next
+    window rows, ties broken by their order, so the cost is linear in the
+    number of rows. The rows should already be close to a good order,
+    e.g. in gray order.
+    """
+    rows = iter(rows)
+    pending = list(itertools.islice(rows, window))
+    ordered = []
+    while pending:
+        if ordered:
+            current = ordered[-1]
+            best = min(range(len(pending)), key = lambda i: (
+                sum(cost for cost, a, b in zip(costs, current, pending[i])
+                    if a != b), i))
+        else:
+            best = 0
+        ordered.append(pending.pop(best))
+        pending.extend(itertools.islice(rows, 1))
+    return ordered
+
+def order_set(param_set, mode, change_costs):
+    """Reorder the combinations of a set to lower the reconfiguration cost
+
+    Returns the cost of the changes of vals between consecutive
+    combinations, before and after reordering.
+    """
+    radices = param_set.radices()
+    costs = dim_costs(param_set, change_costs)
+    # the most expensive dimensions change the least
+    order = sorted(range(len(radices)), key = lambda pos: -costs[pos])
+
+    if param_set.rows is None and param_set.checks is None:
+        # full product: each dimension changes once per val of the slower
+        # ones in product order, and once per step of its own sweep in gray
+        # order, which is optimal with the costs sorted
+        before = sum(cost * (math.prod(radices[:pos + 1]) - 1)
+                     for pos, cost in enumerate(costs))
+        if mode == "product":
+            return (before, before)
+        param_set.gray = order
+        slower = 1
+        after = 0
+        for pos in order:
+            after += costs[pos] * (radices[pos] - 1) * slower
+            slower *= radices[pos]
+        return (before, after)
+
+    # selected combinations, in dimension val indexes
+    if param_set.checks is not None:
+        rows = list(iter_constrained(radices, param_set.checks))
+    else:
+        rows = param_set.rows
+    before = sequence_cost(costs, rows)
+    if mode == "product":
+        return (before, before)
+    ordered = sorted(rows, key = lambda idx: gray_rank(radices, order, idx))
+    after = sequence_cost(costs, ordered)
+    if mode == "greedy":
+        greedy = greedy_order(costs, ordered)
+        greedy_cost = sequence_cost(costs, greedy)
+        if greedy_cost < after:
+            ordered, after = greedy, greedy_cost
+    param_set.rows = ordered
+    param_set.checks = None
+    return (before, after)
+
+def iter_constrained(radices, checks):
+    """Yield the val indexes of the product passing all the checks
+
+    The params are set depth first, in order, and the checks of a position
+    run as soon as its param is set: a failed check prunes all the
+    combinations below it. The params after the last checked one are not
+    constrained, their product is appended to each valid prefix. The order
+    is the same as update_vals().
+    """
+    last = max((pos for pos in range(len(radices)) if checks[pos]),
+               default = -1)
+    tail = [ range(radix) for radix in radices[last + 1:] ]
+    if last < 0:
+        yield from itertools.product(*tail)
+        return
+    idx = [-1] * (last + 1)
+    pos = 0
+    while pos >= 0:
+        idx[pos] += 1
+        if idx[pos] == radices[pos]:
+            # all the vals of this param done, back to the previous one
+            idx[pos] = -1
+            pos -= 1
+            continue
+        if not all(check(idx) for check in checks[pos]):
+            continue
+        if pos == last:
+            prefix = tuple(idx)
+            for suffix in itertools.product(*tail):
+                yield prefix + suffix
+        else:
+            pos += 1
+
+def numeric_val(val):
+    """Return a val as a number for comparisons, None if it is not one"""
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return None
+
+def compile_condition(cond, positions):
+    """Compile a constraint condition into tests of the val indexes
+
+    Each test is a (positions, allowed) tuple: the val index of a param, or
+    the pair of val indexes of two compared params, must be in allowed.
+    The positions map the param keys to (dimension, record) tuples. None
+    is returned if the condition refers to params not in the set.
+    """
+    found = positions.get(param_key(cond))
+    if found is None:
+        return None
+    pos, record = found
+    vals = record.vals
+    allowed = set(range(len(vals)))
+    if "vals" in cond:
+        allowed.intersection_update(i for i, val in enumerate(vals)
+                                    if val in cond["vals"])
+    if "not-vals" in cond:
+        allowed.difference_update(i for i, val in enumerate(vals)
+                                  if val in cond["not-vals"])
+
+    tests = []
+    for op, compare in CONSTRAINT_OPS.items():
+        if op not in cond:
+            continue
+        if not isinstance(cond[op], dict):
+            # compare to a number
+            allowed.intersection_update(
+                i for i in list(allowed) if numeric_val(vals[i]) is not None
+                and compare(numeric_val(vals[i]), cond[op]))
+            continue
+        # compare to the val of another param of the combination
+        found = positions.get(param_key(cond[op]))
+        if found is None:
+            return None
+        other, other_record = found
+        other_vals = [ numeric_val(val) for val in other_record.vals ]
+        pairs = set()
+        for i, val in enumerate(vals):
+            val = numeric_val(val)
+            if val is None:
+                continue
+            pairs.update((i, j) for j, other_val in enumerate(other_vals)
+                         if other_val is not None and compare(val, other_val))
+        tests.append(((pos, other), pairs))
+
+    tests.append(((pos,), allowed))
+    return tests
+
+def compile_constraint(rule, positions):
+    """Compile a constraint rule into (dimensions, check(idx)) for a set
+
+    The dimensions are the ones the rule refers to, in order: the check is
+    run once the last one is set. None is returned if the rule refers to
+    params not in the set, which are not constrained by it.
+    """
+    clauses = []
+    for part in ( "exclude", "if", "then" ):
+        if part not in rule:
+            continue
+        clause = []
+        for cond in rule[part]:
+            tests = compile_condition(cond, positions)
+            if tests is None:
+                return None
+            clause.extend(tests)
+        clauses.append(clause)
+
+    def holds(clause, idx):
+        for pos, allowed in clause:
+            if len(pos) == 1:
+                if idx[pos[0]] not in allowed:
+                    return False
+            elif (idx[pos[0]], idx[pos[1]]) not in allowed:
+                return False
+        return True
+
+    if "exclude" in rule:
+        exclude = clauses[0]
+        check = lambda idx: not holds(exclude, idx)
+    else:
+        when, then = clauses
+        check = lambda idx: not holds(when, idx) or holds(then, idx)
+
+    dims = sorted({ p for clause in clauses for pos, _ in clause for p in pos })
+    return (tuple(dims), check)
+
+def set_strength(options, strategy = None):
+    """Return the covering strength t of a set, None for the full product"""
+    # the command line (a strategy name or a t number) overrides the set
+    if strategy is not None:
+        return STRATEGIES.get(strategy, strategy)
+    if "t-wise" in options:
+        return options["t-wise"]
+    return STRATEGIES[options.get("strategy", "full")]
+
+def prepare_set(raw_set, options = None, strategy = None, transformer = None,
+                constraints = ()):
+    """Validate and transform one multi-value set, ready for expansion
+
+    The options of the set default to none, the transformer to the one of
+    the loaded validations (create_validation_dict()), the constraints of
+    the requirements to none.
+    """
+    if options is None:
+        options = {}
+    if transformer is None:
+        transformer = param_transformer()
+    # step 1: check role, remove disabled params
+    obj = sanitize_set(raw_set)
+    records = []
+
+    # iterate over the original set obj
+    for param in obj:
+        # step 2: validate and transform the param vals
+        vals = transformer.transform_vals(param['arg'], param['vals'])
+
+        # step 3: intern the param, shared by all the combinations
+        records.append(ParamRecord(param, vals))
+
+    # step 4: zip the linked params into single dimensions of the product
+    links = link_params(records, options.get("links", []))
+    param_set = ParamSet(tuple(records), links)
+
+    # step 5: compile the constraints of the requirements and the set
+    dims = param_set.record_idx(range(len(records)))
+    positions = { param_key(record.keys): (dims[pos], record)
+                  for pos, record in enumerate(records) }
+    compiled = [ compile_constraint(rule, positions) for rule in
+                 list(constraints) + options.get("constraints", []) ]
+    compiled = [ constraint for constraint in compiled if constraint is not None ]
+
+    # step 6: select the combinations of a covering array, if requested,
+    # built from valid combinations only
+    strength = set_strength(options, strategy)
+    if strength is not None:
+        param_set.rows = covering_array(param_set.radices(), strength, compiled)
+
+    if compiled and param_set.rows is None:
+        checks = [ [] for _ in param_set.radices() ]
+        for dims, check in compiled:
+            checks[dims[-1]].append(check)
+        param_set.checks = checks
+
+    return param_set
+
+def prepare_sets(obj, set_options = None, strategy = None, transformer = None,
+                 constraints = ()):
+    """Validate and transform all the multi-value sets"""
+    if set_options is None:
+        set_options = []
+    return [ prepare_set(param_set,
+                         set_options[idx] if idx < len(set_options) else {},
+                         strategy, transformer, constraints)
+             for idx, param_set in enumerate(obj) ]
+
+def update_vals(records):
+    """Yield one combination per cartesian product entry"""
+    """
+    a set with:
+        { "arg": "mtu", "vals": ["1518", "9216"] },
+        { "arg": "frame-size", "vals": ["64", "9000"] }
+    becomes a stream of val index tuples (cartesian product):
+        (0,0), (0,1), (1,0), (1,1)
+    each one referencing the shared records instead of copying the set
+    """
+    ranges = [ range(len(record.vals)) for record in records ]
+    for idx in itertools.product(*ranges):
+        yield Combination(records, idx)
+
+def multiplex_sets(obj):
+    """Parse multiple sets, yielding one combination at a time"""
+    # validate and transform the vals of every set up front, so a validation
+    # failure is reported before anything has been emitted
+    yield from expand_sets(prepare_sets(obj))
+
+def expand_sets(param_sets, start = 0, stop = None):
+    """Yield the combinations of prepared sets, one at a time
+
+    Combinations have a global index, counting from the first combination
+    of the first set, and only the ones from start to stop are generated.
+    """
+    offset = 0
+    for param_set in param_sets:
+        if stop is not None and offset >= stop:
+            break
+        count = param_set.count()
+        if start < offset + count:
+            set_stop = None if stop is None else stop - offset
+            yield from param_set.combinations(max(start - offset, 0), set_stop)
+        offset += count
+
+def combination_at(param_sets, k):
+    """Return the combination with the global index k, without expansion"""
+    offset = 0
+    for param_set in param_sets:
+        count = param_set.count()
+        if k < offset + count:
+            return param_set.combination(k - offset)
+        offset += count
+    raise IndexError("combination index %d out of range (%d combinations)"
+                     % (k, offset))
+
+def select_range(total, shard = None, index_range = None):
+    """Return the (start, stop) global indexes selected by --shard/--range"""
+    if shard is not None:
+        # shard i/N: the i-th of N contiguous, balanced slices
+        i, n = shard
+        return (total * (i - 1) // n, total * i // n)
+    if index_range is not None:
+        start, stop = index_range
+        start = min(total, 0 if start is None else start)
+        stop = total if stop is None else min(total, stop)
+        return (start, max(start, stop))
+    return (0, total)
+
+def cost_val(val):
+    """Return the number of a val for the run cost, e.g. 4 for '4KB'"""
+    number = numeric_val(val)
+    if number is None:
+        match = RE_UNIT_VAL.match(val)
+        if match is not None:
+            number = float(match.group(1))
+    return number
+
+def compile_run_cost(param_set, terms):
+    """Compile the run cost model into a function of the val indexes of a set
+
+    The cost of a combination is the sum of the terms: a weight per val of
+    a param, or a product expression of numbers and args (the numeric vals
+    of the first param of the set with that arg), e.g. 'runtime * numjobs'.
+    Terms referring to args not in the set are ignored, non-numeric vals
+    count as 0.
+    """
+    records = param_set.records
+    keys = { param_key(record.keys): pos for pos, record in enumerate(records) }
+    args_pos = {}
+    for pos, record in enumerate(records):
+        args_pos.setdefault(record.keys['arg'], pos)
+
+    # each term is a constant and tables of the factors of each val
+    compiled = []
+    for term in terms:
+        if isinstance(term, dict):
+            pos = keys.get(param_key(term))
+            if pos is None:
+                continue
+            weights = term["weights"]
+            table = [ weights.get(val, term.get("default", 0))
+                      for val in records[pos].vals ]
+            compiled.append((1, [ (pos, table) ]))
+            continue
+
+        tokens = RE_COST_EXPR.split(term.strip())
+        constant = 1
+        factors = []
+        for operator_token, operand in zip([ '*' ] + tokens[1::2],
+                                           tokens[0::2]):
+            number = numeric_val(operand)
+            if number is not None:
+                table = None
+            elif operand in args_pos:
+                pos = args_pos[operand]
+                table = [ cost_val(val) or 0 for val in records[pos].vals ]
+            else:
+                break
+            if operator_token == '/':
+                if table is None:
+                    number = 1 / number if number else 0
+                else:
+                    table = [ 1 / v if v else 0 for v in table ]
+            if table is None:
+                constant *= number
+            else:
+                factors.append((pos, table))
+        else:
+            compiled.append((constant, factors))
+
+    def run_cost(idx):
+        cost = 0
+        for constant, factors in compiled:
+            term = constant
+            for pos, table in factors:
+                term *= table[idx[pos]]
+            cost += term
+        return cost
+    return run_cost
+
+def combination_costs(param_sets, terms):
+    """Return the run cost of each combination, by global index"""
+    costs = array('d')
+    for param_set in param_sets:
+        if terms:
+            run_cost = compile_run_cost(param_set, terms)
+            costs.extend(run_cost(combination.idx)
+                         for combination in param_set.combinations())
+        else:
+            # without a cost model, all the combinations cost the same
+            costs.extend(itertools.repeat(1, param_set.count()))
+    return costs
+
+def partition_costs(costs, n, skip = ()):
+    """Assign the combinations to n partitions of balanced total costs
+
+    Longest processing time first: the most expensive combinations are
+    assigned first, each one to the partition with the lowest total cost
+    so far (the first one on ties). Returns the partition of each
+    combination, n for the skipped ones, and the total cost of each
+    partition.
+    """
+    assignment = array('I', [n]) * len(costs)
+    loads = [ (0, p) for p in range(n) ]
+    for k in sorted(range(len(costs)), key = costs.__getitem__,
+                    reverse = True):
+        if k in skip:
+            continue
+        load, p = heapq.heappop(loads)
+        assignment[k] = p
+        heapq.heappush(loads, (load + costs[k], p))
+    return assignment, [ load for load, p in sorted(loads, key = lambda l: l[1]) ]
+
+def partition_path(output, p):
+    """Return the output file of the p-th partition, e.g. params-1.json"""
+    root, ext = os.path.splitext(output)
+    return "%s-%d%s" % (root, p, ext)
+
+def set_output_bytes(param_set, format = "readable", columns = 0, start = 0,
+                     stop = None, skipped = ()):
+    """Size of the combinations of a set in an output of format, columns
+    being the number of output_columns() of a columnar output
+
+    Only the combinations from start to stop are counted, but the skipped
+    ones (indexes in the set).
+    """
+    records = param_set.records
+    count = param_set.count()
+    if stop is None or stop > count:
+        stop = count
+    if format == "columnar":
+        # each row is '[' + the vals of all the columns joined by ',' + ']',
+        # null for the params not in the set
+        fixed = 1 + max(columns, 1) + 4 * (columns - len(records))
+    elif len(records) == 0:
+        # '    []' or '[]' for each combination
+        fixed = 6 if format == "readable" else 2
+    elif format == "readable":
+        # each combination is '    [\n' + params joined by ',\n' + '\n    ]'
+        fixed = 12 + 2 * (len(records) - 1)
+    else:
+        # each combination is '[' + params joined by ',' + ']'
+        fixed = 1 + len(records)
+    val_bytes = []
+    for record in records:
+        val_bytes.append([])
+        for val_idx in range(len(record.vals)):
+            if format == "columnar":
+                text = dump_json(record.vals[val_idx], 'parseable')
+                val_bytes[-1].append(len(text))
+            elif format == "readable":
+                text = dump_json(record.single_value(val_idx))
+                # params are nested 8 spaces deep in the output
+                val_bytes[-1].append(len(text) + 8 * (text.count('\n') + 1))
+            else:
+                text = dump_json(record.single_value(val_idx), 'parseable')
+                val_bytes[-1].append(len(text))
+
+    size = 0
+    if (start, stop) != (0, count) or len(skipped) > 0:
+        # part of the set: walk the val indexes of its combinations
+        for k, combination in enumerate(param_set.combinations(start, stop),
+                                        start):
+            if k not in skipped:
+                size += fixed + sum(b[val_idx] for b, val_idx in
+                                    zip(val_bytes, combination.idx))
+        return size
+
+    size = count * fixed
+    selection = param_set.selection()
+    if selection is not None:
+        for idx in selection:
+            size += sum(b[val_idx] for b, val_idx in zip(val_bytes, idx))
+    else:
+        # each val of a param is used by count / len(vals) combinations
+        for b in val_bytes:
+            size += count // len(b) * sum(b)
+    return size
+
+def count_sets(param_sets, top = 10, format = "readable", start = 0,
+               stop = None, skipped = (), outputs = None):
+    """Report combination counts and output size (in format), without
+    expansion
+
+    The output is the combinations from start to stop (global indexes),
+    but the skipped ones, split in outputs of the given numbers of
+    combinations (a single output by default).
+    """
+    report = { "sets": [], "multipliers": [] }
+    total = 0
+    output_bytes = 0
+    columns = 0
+    if format == "columnar":
+        columns = len(output_columns(param_sets))
+    # combinations a param adds to the matrix: the ones that would be gone
+    # if it had a single val
+    added = defaultdict(int)
+
+    offset = 0
+    for set_idx, param_set in enumerate(param_sets):
+        count = param_set.count()
+        full_product = param_set.rows is None and param_set.checks is None
+        multipliers = []
+        for record in param_set.records:
+            if len(record.vals) > 1:
+                key = param_key(record.keys)
+                multipliers.append({ "arg": key[0], "role": key[1],
+                                     "id": key[2], "vals": len(record.vals) })
+                if full_product:
+                    added[key] += count - count // len(record.vals)
+        multipliers.sort(key = lambda m: m["vals"], reverse = True)
+
+        report["sets"].append({ "set": set_idx, "combinations": count,
+                                "multipliers": multipliers })
+        # the output combinations of the set
+        set_start = min(max(start - offset, 0), count)
+        set_stop = count if stop is None else min(max(stop - offset, 0), count)
+        set_skipped = { k - offset for k in skipped
+                        if set_start <= k - offset < set_stop }
+        if set_start < set_stop:
+            total += set_stop - set_start - len(set_skipped)
+            output_bytes += set_output_bytes(param_set, format, columns,
+                                             set_start, set_stop, set_skipped)
+        offset += count
+
+    for key, combinations in sorted(added.items(), key = lambda a: a[1],
+                                    reverse = True)[:top]:
+        report["multipliers"].append({ "arg": key[0], "role": key[1],
+                                       "id": key[2],
+                                       "combinations": combinations })
+
+    # opening + combinations joined by the separator + closing, or empty,
+    # for each output
+    opening, separator, closing, empty = output_framing(param_sets, format)
+    for combinations in (outputs if outputs is not None else [ total ]):
+        if combinations > 0:
+            output_bytes += len(opening) + len(separator) * \
+                (combinations - 1) + len(closing)
+        else:
+            output_bytes += len(empty)
+    report["combinations"] = total
+    report["output-bytes"] = output_bytes
+    return report
+
+def convert_vals(obj):
+    """Convert vals into val for each single-value set"""
+    for param_set in obj:
+        if isinstance(param_set, Combination):
+            yield param_set.to_dicts()
+            continue
+
+        # single-value sets in the json format, with a one-val vals array
+        new_set = []
+        for param in param_set:
+            new_param = { k: v for k, v in param.items() if k != 'vals' }
+            new_param['val'] = param['vals'][0]
+            new_set.append(new_param)
+        yield new_set
+
+def load_presets(json_req):
+    """Create a dict for presets"""
+    if "presets" in json_req:
+        presets_dict.update(json_req["presets"])
+
+def override_presets(json_obj, presets = None):
+    """Override params w/ presets loaded from the requirements file"""
+    if presets is None:
+        presets = presets_dict
+
+    if len(json_obj) == 0:
+        json_obj = [[]]
+
+    defaults = presets.get("defaults")
+
+    # essentials overlay keyed by (arg, role, id), computed once and applied
+    # to each set without modifying the presets
+    essentials = None
+    if "essentials" in presets:
+        essentials = resolve_params(presets["essentials"])
+    ess_index = {}
+    for _ess in essentials or []:
+        ess_index.setdefault(param_key(_ess), _ess)
+
+    overriden = []
+    for _json in json_obj:
+        # apply default params if empty set
+        if defaults is not None and len(_json) == 0:
+            _json = copy.deepcopy(defaults)
+
+        # append essential params, override duplicates
+        if essentials is not None:
+            if len(_json) > 0:
+                _set = []
+                _overriden = set()
+                for _param in _json:
+                    key = param_key(_param)
+                    if key in ess_index and key not in _overriden:
+                        # override param with essential
+                        _set.append(ess_index[key])
+                        _overriden.add(key)
+                    else:
+                        _set.append(_param)
+
+                # append essentials (new/undefined ones)
+                for _ess in essentials:
+                    if param_key(_ess) not in _overriden:
+                        _set.append(_ess)
+                _json = _set
+            else:
+                _json = copy.deepcopy(essentials)
+
+        overriden.append(_json)
+
+    # If after the overrides, we find an empty set, we cannot continue.
+    for _json in overriden:
+        if _json == [] or len(_json) == 0:
+            log.error("An empty param set has been found."
+                      " Define preset params (essentials and/or defaults)"
+                      " in the requirements file for minimum required params.")
+            return None
+
+    return overriden
+
+def param_key(param):
+    """Return the (arg, role, id) key identifying a param in a set"""
+    return (param["arg"], param.get("role", "client"), param.get("id", "1"))
+
+def load_validations(req_json, validation_dict, convert_dict, transform_dict,
+                     cost_dict = None):
+    """Fill the validation, conversion, transform and cost dicts of args"""
+    validations = req_json["validations"]
+    for _vgroup in validations:
+        for _param in validations[_vgroup]["args"]:
+            _vals = validations[_vgroup]["vals"]
+            _pattern = { _param: _vals }
+            validation_dict.update(_pattern)
+
+            if "convert" in validations[_vgroup]:
+                _convert = validations[_vgroup]["convert"]
+                if "units" in req_json and len(req_json["units"]) > 0:
+                    if _vgroup in req_json["units"]:
+                        if _convert in req_json["units"][_vgroup]:
+                            _cexpr = req_json["units"][_vgroup][_convert]
+                            _conversion = { _convert: _cexpr }
+                            convert_dict.update({ _param: _conversion })
+                        else:
+                            log.warning("Conversion '%s' has not been found "
+                                        " and will be skipped.", _convert)
+                    else:
+                        log.warning("No conversion has been found "
+                                     "for the param '%s'.", _param)
+                else:
+                    log.warning("The 'units' section has not been found. "
+                                "Ignoring all conversions.")
+
+            if "transform" in validations[_vgroup]:
+                _transform = validations[_vgroup]["transform"]
+                _replace = { _param: _transform }
+                transform_dict.update(_replace)
+
+            if cost_dict is not None and "change-cost" in validations[_vgroup]:
+                cost_dict[_param] = validations[_vgroup]["change-cost"]
+
+def create_validation_dict(req_json):
+    """Create validation dict from requirements"""
+    global _transformer
+
+    load_validations(req_json, validation_dict, convert_dict, transform_dict)
+
+    # compile the patterns once, for all the sets
+    _transformer = None
+    param_transformer()
+
+def load_json_file(json_file):
+    """Load JSON file and return a json object"""
+    try:
+        input_fp = open(json_file, 'r')
+        input_json = json.load(input_fp)
+        input_fp.close()
+    except:
+        log.exception("Could not load JSON file %s" % (json_file))
+        return None
+    return input_json
+
+def unique_key(item):
+    """Return a hashable key, equal for equal JSON values"""
+    # JSON equality: 1 == 1.0 but true != 1, and objects ignore key order
+    if isinstance(item, str):
+        # never equal to the tuples used for the other types
+        return item
+    if isinstance(item, bool):
+        return ('b', item)
+    if isinstance(item, (int, float)):
+        return ('n', item)
+    if isinstance(item, list):
+        return ('a', tuple(unique_key(i) for i in item))
+    if isinstance(item, dict):
+        return ('o', frozenset((k, unique_key(v)) for k, v in item.items()))
+    return ('z', item)
+
+def unique_items(validator, uI, instance, schema):
+    """uniqueItems check in linear time, hashing the array items"""
+    if uI and validator.is_type(instance, "array"):
+        seen = set()
+        for item in instance:
+            key = unique_key(item)
+            if key in seen:
+                from jsonschema import exceptions
+                yield exceptions.ValidationError(
+                    "%r has non-unique elements" % (instance,))
+                return
+            seen.add(key)
+
+# draft-7 keywords not handled by compile_schema(), which then falls back to
+# the jsonschema validator for the whole schema
+UNCOMPILED_KEYWORDS = { "additionalItems", "allOf", "const", "contains",
+                        "dependencies", "else", "exclusiveMaximum",
+                        "exclusiveMinimum", "if", "maxItems", "maxLength",
+                        "maxProperties", "multipleOf",
+                        "not", "oneOf", "propertyNames", "then" }
+
+def json_type_check(types):
+    """Return a function checking the JSON type of an instance"""
+    classes = { "array": list, "object": dict, "string": str,
+                "null": type(None) }
+    if all(t in classes for t in types):
+        instance_classes = tuple(classes[t] for t in types)
+        return lambda i: isinstance(i, instance_classes)
+
+    def check_type(i):
+        for t in types:
+            if t in classes and isinstance(i, classes[t]):
+                return True
+            if t == "boolean" and isinstance(i, bool):
+                return True
+            if isinstance(i, bool):
+                continue
+            if t == "number" and isinstance(i, (int, float)):
+                return True
+            if t == "integer" and (isinstance(i, int) or
+                                   isinstance(i, float) and i.is_integer()):
+                return True
+        return False
+    return check_type
+
+def compile_schema(schema, root = None, refs = None):
+    """Compile a schema into a check(instance) function returning a bool
+
+    Only the keywords used by the multiplex schemas are supported, an
+    UncompiledSchemaError is raised for any other validation keyword.
+    """
+    if root is None:
+        root = schema
+    if refs is None:
+        refs = {}
+    if isinstance(schema, bool):
+        return lambda instance: schema
+
+    unsupported = UNCOMPILED_KEYWORDS.intersection(schema)
+    if unsupported or isinstance(schema.get("items"), list):
+        raise UncompiledSchemaError("Schema keywords %s" % sorted(unsupported))
+
+    if "$ref" in schema:
+        ref = schema["$ref"]
+        if not ref.startswith("#/"):
+            raise UncompiledSchemaError("Schema reference %s" % ref)
+        if ref not in refs:
+            # placeholder first, for recursive references
+            cell = []
+            refs[ref] = lambda instance: cell[0](instance)
+            target = root
+            for part in ref[2:].split("/"):
+                target = target[part.replace("~1", "/").replace("~0", "~")]
+            cell.append(compile_schema(target, root, refs))
+        # draft-7: siblings of $ref are ignored
+        return refs[ref]
+
+    check_type = None
+    if "type" in schema:
+        types = schema["type"]
+        check_type = json_type_check([types] if isinstance(types, str)
+                                     else types)
+
+    enum_strs = enum_keys = None
+    if "enum" in schema:
+        if all(isinstance(e, str) for e in schema["enum"]):
+            enum_strs = set(schema["enum"])
+        else:
+            enum_keys = { unique_key(e) for e in schema["enum"] }
+
+    any_of = None
+    if "anyOf" in schema:
+        any_of = [ compile_schema(s, root, refs) for s in schema["anyOf"] ]
+
+    # numbers
+    minimum = schema.get("minimum")
+    maximum = schema.get("maximum")
+
+    # strings
+    min_length = schema.get("minLength")
+    pattern = None
+    if "pattern" in schema:
+        pattern = re.compile(schema["pattern"])
+
+    # arrays
+    min_items = schema.get("minItems")
+    unique = schema.get("uniqueItems", False)
+    check_item = None
+    if "items" in schema:
+        check_item = compile_schema(schema["items"], root, refs)
+
+    # objects
+    min_props = schema.get("minProperties")
+    required = schema.get("required")
+    props = pattern_props = additional = None
+    if ("properties" in schema or "patternProperties" in schema or
+            "additionalProperties" in schema):
+        props = { k: compile_schema(v, root, refs)
+                  for k, v in schema.get("properties", {}).items() }
+        pattern_props = [ (re.compile(k), compile_schema(v, root, refs))
+                          for k, v in schema.get("patternProperties", {}).items() ]
+        additional = compile_schema(schema.get("additionalProperties", True),
+                                    root, refs)
+
+    def check(i):
+        if check_type is not None and not check_type(i):
+            return False
+        if enum_strs is not None and not (isinstance(i, str) and
+                                          i in enum_strs):
+            return False
+        if enum_keys is not None and unique_key(i) not in enum_keys:
+            return False
+        if any_of is not None and not any(c(i) for c in any_of):
+            return False
+
+        if isinstance(i, (int, float)) and not isinstance(i, bool):
+            if minimum is not None and i < minimum:
+                return False
+            if maximum is not None and i > maximum:
+                return False
+
+        elif isinstance(i, str):
+            if min_length is not None and len(i) < min_length:
+                return False
+            if pattern is not None and pattern.search(i) is None:
+                return False
+
+        elif isinstance(i, list):
+            if min_items is not None and len(i) < min_items:
+                return False
+            if unique and len({ unique_key(e) for e in i }) != len(i):
+                return False
+            if check_item is not None:
+                for e in i:
+                    if not check_item(e):
+                        return False
+
+        elif isinstance(i, dict):
+            if min_props is not None and len(i) < min_props:
+                return False
+            if required is not None:
+                for r in required:
+                    if r not in i:
+                        return False
+            if props is not None:
+                for k, v in i.items():
+                    matched = False
+                    if k in props:
+                        matched = True
+                        if not props[k](v):
+                            return False
+                    for regex, check_prop in pattern_props:
+                        if regex.search(k) is not None:
+                            matched = True
+                            if not check_prop(v):
+                                return False
+                    if not matched and not additional(v):
+                        return False
+        return True
+
+    return check
+
+class SchemaValidator:
+    """Schema compiled into a fast check, with jsonschema for the errors"""
+
+    def __init__(self, schema_contents):
+        self.schema = schema_contents
+        try:
+            self.check = compile_schema(schema_contents)
+        except UncompiledSchemaError:
+            log.debug("Schema can not be compiled, using jsonschema only",
+                      exc_info = True)
+            self.check = None
+
+    @functools.cached_property
+    def validator(self):
+        """jsonschema validator, only imported and built to report errors"""
+        from jsonschema import validators
+        validator_class = validators.validator_for(self.schema)
+        validator_class.check_schema(self.schema)
+        # the default uniqueItems is quadratic for arrays of objects (sets)
+        validator_class = validators.extend(validator_class,
+                                            { "uniqueItems": unique_items })
+        return validator_class(self.schema)
+
+    def validate(self, instance):
+        """Raise a ValidationError if the instance is not valid"""
+        # one pass of the compiled check for valid documents, jsonschema
+        # only runs to report the errors of an invalid one
+        if self.check is not None and self.check(instance):
+            return
+        self.validator.validate(instance)
+
+def schema_validator(schema_file):
+    """Return the compiled validator of a schema file"""
+    with open(schema_path(schema_file), 'rb') as schema_fp:
+        return compiled_schema(schema_fp.read())
+
+@functools.lru_cache(maxsize=SCHEMA_CACHE_SIZE)
+def compiled_schema(schema_bytes):
+    """Check and compile a schema once per contents"""
+    return SchemaValidator(json.loads(schema_bytes))
+
+def schema_path(schema_file):
+    """Return the path of a schema file shipped with multiplex"""
+    return "%s/JSON/%s" % (os.path.dirname(os.path.abspath(__file__)),
+                           schema_file)
+
+def validate_schema(input_json, schema_file):
+    """Validate json with schema file"""
+    try:
+        schema_validator(schema_file).validate(input_json)
+    except:
+        log.exception("JSON validation failed for %s using schema %s"
+                      % (input_json, schema_path(schema_file)))
+        return False
+    return True
+
+class Multiplexer:
+    """Expand multi-value inputs with a set of requirements
+
+    All the state (validations, conversions, presets, constraints, costs)
+    belongs to the instance and is not modified once built, so the same
+    multiplexer can expand any number of inputs, from several threads.
+    Failures raise MultiplexError subclasses, carrying the exit code of
+    the command line, instead of exiting.
+    """
+
+    def __init__(self, requirements = None, strategy = None):
+        """Compile the requirements (a json object, None for no requirements)"""
+        if (requirements is not None and
+                not validate_schema(requirements, "req-schema.json")):
+            raise RequirementsSchemaError(
+                "The requirements do not match the schema")
+        requirements = requirements or {}
+
+        self.validations = {}
+        self.conversions = {}
+        self.transforms = {}
+        self.change_costs = {}
+        if "validations" in requirements:
+            load_validations(requirements, self.validations, self.conversions,
+                             self.transforms, self.change_costs)
+        self.presets = dict(requirements.get("presets", {}))
+        self.constraints = list(requirements.get("constraints", []))
+        self.run_cost = list(requirements.get("run-cost", []))
+        self.transformer = ParamTransformer(self.validations, self.conversions,
+                                            self.transforms)
+        # covering array strategy for all the sets, overriding the sets
+        self.strategy = strategy
+
+    @classmethod
+    def from_compiled(cls, compiled, strategy = None):
+        """Rebuild a multiplexer from compiled(), without any validation"""
+        multiplexer = cls.__new__(cls)
+        multiplexer.validations = compiled["validations"]
+        multiplexer.conversions = compiled["conversions"]
+        multiplexer.transforms = compiled["transforms"]
+        multiplexer.change_costs = compiled["change-costs"]
+        multiplexer.presets = compiled["presets"]
+        multiplexer.constraints = compiled["constraints"]
+        multiplexer.run_cost = compiled["run-cost"]
+        multiplexer.transformer = ParamTransformer(multiplexer.validations,
+                                                   multiplexer.conversions,
+                                                   multiplexer.transforms)
+        multiplexer.strategy = strategy
+        return multiplexer
+
+    def compiled(self):
+        """Return the validated and compiled requirements, as a json object"""
+        return { "validations": self.validations,
+                 "conversions": self.conversions,
+                 "transforms": self.transforms,
+                 "change-costs": self.change_costs,
+                 "presets": self.presets,
+                 "constraints": self.constraints,
+                 "run-cost": self.run_cost }
+
+    def prepare(self, input_json, validate = True):
+        """Validate an input and prepare its sets, ready for expansion"""
+        if validate and not validate_schema(input_json, "schema.json"):
+            raise SchemaError("The input does not match the schema")
+        set_options = []
+        combined_json = load_param_sets(input_json, set_options, self.presets)
+        overriden_json = override_presets(combined_json, self.presets)
+        if overriden_json is None:
+            raise EmptySetError("An empty param set has been found")
+        return prepare_sets(overriden_json, set_options, self.strategy,
+                            self.transformer, self.constraints)
+
+    def order(self, param_sets, mode):
+        """Reorder the combinations of the sets, see order_set()"""
+        return [ order_set(param_set, mode, self.change_costs)
+                 for param_set in param_sets ]
+
+    def costs(self, param_sets):
+        """Return the run cost of each combination, by global index"""
+        return combination_costs(param_sets, self.run_cost)
+
+    def expand(self, input_json, start = 0, stop = None):
+        """Return an iterator over the single-value sets of an input
+
+        The input is validated and its vals transformed up front, so errors
+        are raised by this call; the combinations are then generated one at
+        a time, from the global index start to stop.
+        """
+        param_sets = self.prepare(input_json)
+        return convert_vals(expand_sets(param_sets, start, stop))
+
+_multiplexers = OrderedDict()
+
+def cache_dir():
+    """Return the directory of the compiled requirements cache, None if off"""
+    path = os.environ.get(CACHE_ENV)
+    if path is None:
+        path = os.path.join(os.environ.get("XDG_CACHE_HOME") or
+                            os.path.join(os.path.expanduser("~"), ".cache"),
+                            "multiplex")
+    return path or None
+
+@functools.lru_cache(maxsize=None)
+def cache_key_prefix():
+    """Hash of the code and schemas the cached entries depend on"""
+    digest = hashlib.blake2b(str(CACHE_VERSION).encode())
+    for path in [ os.path.abspath(__file__), schema_path("schema.json"),
+                  schema_path("req-schema.json") ]:
+        with open(path, 'rb') as code_fp:
+            digest.update(code_fp.read())
+    return digest.digest()
+
+def cached_requirements(req_bytes, directory):
+    """Return the cached compiled requirements of contents, None if missing
+
+    The entries are keyed by the hash of the requirements contents, and of
+    multiplex and its requirements schema, so any change invalidates them.
+    """
+    key = hashlib.blake2b(cache_key_prefix() + req_bytes,
+                          digest_size=16).hexdigest()
+    path = os.path.join(directory, "requirements-%s.json" % key)
+    try:
+        with open(path, 'r', encoding="utf-8") as cache_fp:
+            compiled = json.load(cache_fp)
+        if compiled.get("key") == key:
+            touch_entry(path)
+            return path, compiled
+        log.debug("Ignoring the cached requirements %s: wrong key", path)
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, AttributeError):
+        log.debug("Ignoring the cached requirements %s", path, exc_info = True)
+    return path, None
+
+def cache_requirements(path, compiled):
+    """Write compiled requirements to the cache, failures are only logged"""
+    key = os.path.basename(path)[len("requirements-"):-len(".json")]
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        with open(tmp_path, 'w', encoding="utf-8") as cache_fp:
+            json.dump(dict(compiled, key=key), cache_fp)
+        # atomic: readers never see a partial entry
+        os.replace(tmp_path, path)
+    except OSError:
+        log.debug("Could not cache the requirements to %s", path,
+                  exc_info = True)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    prune_cache(os.path.dirname(path))
+
+def touch_entry(path):
+    """Mark a cache entry as used now, for prune_cache()"""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+def prune_cache(directory):
+    """Evict the cache entries unused for CACHE_MAX_AGE, and the least
+    recently used ones past CACHE_MAX_ENTRIES, failures are only logged"""
+    try:
+        with os.scandir(directory) as scan:
+            entries = [ (entry.stat().st_mtime, entry.path) for entry in scan
+                        if entry.name.startswith(("requirements-", "input-")) ]
+    except OSError:
+        log.debug("Could not list the cache %s", directory, exc_info = True)
+        return
+    entries.sort(reverse = True)
+    expired = time.time() - CACHE_MAX_AGE
+    for pos, (mtime, path) in enumerate(entries):
+        if pos < CACHE_MAX_ENTRIES and mtime >= expired:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # evicted by another process
+            pass
+        except OSError:
+            log.debug("Could not evict %s from the cache", path, exc_info = True)
+
+def validated_input(input_file, directory):
+    """Return the marker of a valid input in the cache, and if it exists
+
+    Inputs are marked by the hash of their contents once validated, so an
+    unchanged input (validated by the same multiplex and schema) is trusted.
+    """
+    try:
+        with open(input_file, 'rb') as input_fp:
+            input_bytes = input_fp.read()
+    except OSError:
+        return None, False
+    key = hashlib.blake2b(cache_key_prefix() + input_bytes,
+                          digest_size=16).hexdigest()
+    marker = os.path.join(directory, "input-%s" % key)
+    if not os.path.exists(marker):
+        return marker, False
+    touch_entry(marker)
+    return marker, True
+
+def mark_validated(marker):
+    """Create the marker of a valid input, failures are only logged"""
+    try:
+        os.makedirs(os.path.dirname(marker), mode=0o700, exist_ok=True)
+        open(marker, 'w').close()
+    except OSError:
+        log.debug("Could not mark the input as validated", exc_info = True)
+        return
+    prune_cache(os.path.dirname(marker))
+
+def load_multiplexer(req_file = None, strategy = None, directory = None):
+    """Return the Multiplexer of a requirements file, None if not loadable
+
+    The multiplexers are kept by contents of the requirements and strategy,
+    the least recently used ones evicted past MULTIPLEXER_CACHE_SIZE, so a
+    long running process compiles the same requirements only once. With a
+    cache directory, the compiled requirements are also kept on disk, and
+    used without validating the requirements again.
+    """
+    req_bytes = None
+    if req_file is not None:
+        try:
+            with open(req_file, 'rb') as req_fp:
+                req_bytes = req_fp.read()
+        except OSError:
+            log.exception("Could not load JSON file %s" % (req_file))
+            return None
+
+    key = (None, strategy)
+    if req_bytes is not None:
+        key = (hashlib.blake2b(req_bytes).digest(), strategy)
+    if key in _multiplexers:
+        _multiplexers.move_to_end(key)
+        return _multiplexers[key]
+
+    compiled = None
+    multiplexer = None
+    if req_bytes is not None and directory is not None:
+        cache_path, compiled = cached_requirements(req_bytes, directory)
+    if compiled is not None:
+        try:
+            multiplexer = Multiplexer.from_compiled(compiled, strategy)
+        except (KeyError, TypeError, AttributeError):
+            # e.g. an entry missing fields, replaced below
+            log.debug("Ignoring the cached requirements %s", cache_path,
+                      exc_info = True)
+    if multiplexer is None:
+        json_req = None
+        if req_bytes is not None:
+            try:
+                json_req = json.loads(req_bytes)
+            except ValueError:
+                log.exception("Could not load JSON file %s" % (req_file))
+                return None
+        multiplexer = Multiplexer(json_req, strategy)
+        if req_bytes is not None and directory is not None:
+            cache_requirements(cache_path, multiplexer.compiled())
+
+    _multiplexers[key] = multiplexer
+    if len(_multiplexers) > MULTIPLEXER_CACHE_SIZE:
+        _multiplexers.popitem(last=False)
+    return multiplexer
+
+def log_skipped(dedup, completed):
+    """Log the duplicate and completed combinations not output"""
+    if dedup is not None:
+        for set_idx, count in enumerate(dedup.duplicates):
+            if count:
+                log.info("Set %d: %d duplicate combinations dropped.",
+                         set_idx, count)
+        log.info("%d duplicate combinations dropped.", sum(dedup.duplicates))
+    if completed is not None:
+        log.info("%d completed combinations skipped.", completed.skipped)
+
+@contextlib.contextmanager
+def open_ids(ids_file):
+    """Open a file of IDs, renamed to ids_file once complete"""
+    tmp_ids = "%s.tmp" % ids_file
+    try:
+        with open(tmp_ids, mode="w", encoding="utf-8") as ids_fp:
+            yield ids_fp
+        os.replace(tmp_ids, ids_file)
+    finally:
+        # never leave a partial list of IDs behind
+        if os.path.exists(tmp_ids):
+            os.remove(tmp_ids)
+
+def write_ids(combinations, ids_file):
+    """Yield the combinations, writing their IDs to a file, one per line"""
+    with open_ids(ids_file) as ids_fp:
+        for combination in combinations:
+            ids_fp.write(combination.content_id() + "\n")
+            yield combination
+
+def output_columns(param_sets):
+    """Return the params (keys but val) of the sets, the columnar header"""
+    columns = {}
+    for param_set in param_sets:
+        for record in param_set.records:
+            columns.setdefault(unique_key(record.keys), record.keys)
+    return list(columns.values())
+
+def columnar_rows(param_sets, combinations):
+    """Yield the vals of combinations in the order of output_columns(),
+    None for the params not in a combination"""
+    columns = { unique_key(keys): pos for pos, keys in
+                enumerate(output_columns(param_sets)) }
+    # column of each param, per set
+    positions = { id(param_set.records): [ columns[unique_key(record.keys)]
+                                           for record in param_set.records ]
+                  for param_set in param_sets }
+    for combination in combinations:
+        row = [ None ] * len(columns)
+        for pos, record, val_idx in zip(positions[id(combination.records)],
+                                        combination.records, combination.idx):
+            row[pos] = record.vals[val_idx]
+        yield row
+
+def output_elements(param_sets, combinations, format = "readable"):
+    """Return the dumped combinations of an output, see output_framing()"""
+    if format == "columnar":
+        return ( dump_json(row, 'parseable') for row in
+                 columnar_rows(param_sets, combinations) )
+    if format == "readable":
+        return ( dump_json_element(item) for item in convert_vals(combinations) )
+    return ( dump_json(item, 'parseable') for item in convert_vals(combinations) )
+
+def output_framing(param_sets, format = "readable"):
+    """Return the opening, separator, closing and empty form of an output"""
+    if format == "columnar":
+        header = '{"columns":%s,"rows":[' % dump_json(output_columns(param_sets),
+                                                      'parseable')
+        return header + '\n', ',\n', '\n]}', header + ']}'
+    if format == "ndjson":
+        return '', '\n', '\n', ''
+    return array_framing('readable' if format == "readable" else 'parseable')
+
+@contextlib.contextmanager
+def open_output(path, compress = False):
+    """Open an output file (stdout if None) for text, gzip-compressed if
+    compress (without name nor time, the same output giving the same file)"""
+    with contextlib.ExitStack() as stack:
+        if path is None:
+            if not compress:
+                yield sys.stdout
+                return
+            sys.stdout.flush()
+            raw = sys.stdout.buffer
+        elif not compress:
+            yield stack.enter_context(open(path, mode="w", encoding="utf-8"))
+            return
+        else:
+            raw = stack.enter_context(open(path, mode="wb"))
+        import gzip
+        compressed = stack.enter_context(gzip.GzipFile(filename = "",
+                                                       mode = "wb",
+                                                       compresslevel = GZIP_LEVEL,
+                                                       fileobj = raw,
+                                                       mtime = 0))
+        # buffered, the compressor is not called once per element
+        text = stack.enter_context(io.TextIOWrapper(
+            io.BufferedWriter(compressed, GZIP_BUFFER), encoding = "utf-8"))
+        yield text
+        text.flush()
+
+def index_path(output):
+    """Return the index file of an output, e.g. params.json.idx"""
+    return "%s.idx" % output
+
+def write_index(index_file, offsets, output_size):
+    """Write the index of an output from the offsets of its combinations"""
+    if sys.byteorder != "little":
+        offsets.byteswap()
+    with open(index_file, mode="wb") as index_fp:
+        index_fp.write(INDEX_HEADER.pack(INDEX_MAGIC, len(offsets) // 2,
+                                         output_size))
+        offsets.tofile(index_fp)
+
+class OutputFile:
+    """An output file written one chunk of dumped combinations at a time
+
+    The chunks are as by dump_json_chunks(), for the framing of
+    output_framing(). The output is written to a temporary file next to
+    it, renamed once complete (with its index_path(), if index), so a
+    failure midway never leaves a truncated output file behind.
+    """
+
+    def __init__(self, output, framing = None, compress = False,
+                 index = False):
+        self.output = output
+        self.framing = framing or array_framing()
+        self.compress = compress
+        self.tmp_files = [ "%s.tmp" % output ]
+        self.offsets = None
+        if index:
+            self.offsets = array('Q')
+            self.tmp_files.append("%s.tmp" % index_path(output))
+        self.stack = contextlib.ExitStack()
+        self.output_fp = None
+        # position of the next chunk, None before the first one
+        self.position = None
+
+    def __enter__(self):
+        try:
+            self.output_fp = self.stack.enter_context(
+                open_output(self.tmp_files[0], self.compress))
+        except BaseException as e:
+            self.__exit__(type(e), e, e.__traceback__)
+            raise
+        return self
+
+    def write(self, chunk):
+        opening, sep = self.framing[:2]
+        if self.position is None:
+            self.output_fp.write(opening)
+            self.position = len(opening)
+        else:
+            self.output_fp.write(sep)
+            self.position += len(sep)
+        if self.offsets is not None:
+            # the dumps are ascii, the length of a chunk is its size
+            self.offsets.append(self.position)
+            self.offsets.append(self.position + len(chunk))
+        self.output_fp.write(chunk)
+        self.position += len(chunk)
+
+    def complete(self):
+        """Close the output and rename it, with its index"""
+        self.output_fp.write(self.framing[3] if self.position is None
+                             else self.framing[2])
+        self.stack.close()
+        if self.offsets is not None:
+            write_index(self.tmp_files[1], self.offsets,
+                        os.path.getsize(self.tmp_files[0]))
+            os.replace(self.tmp_files[1], index_path(self.output))
+        os.replace(self.tmp_files[0], self.output)
+
+    def __exit__(self, exc_type, exc, tb):
+        error = exc
+        if exc_type is None:
+            try:
+                self.complete()
+                return False
+            except BaseException as e:
+                error = e
+        with contextlib.suppress(Exception):
+            self.stack.close()
+        remove_files(self.tmp_files)
+        if isinstance(error, MultiplexError) or \
+                not isinstance(error, Exception):
+            # e.g. validation failure while generating the output
+            if error is not exc:
+                raise error
+            return False
+        log.error("Failed to write to file %s", self.output, exc_info = error)
+        raise OutputWriteError("Failed to write to file %s"
+                               % (self.output)) from error
+
+def dump_output(elements, output = None, framing = None, compress = False,
+                index = False):
+    """Stream the dumped combinations of an output to stdout or file
+
+    elements are the dumped combinations, or chunks of them, as by
+    output_elements() for the framing of output_framing(), a readable json
+    array by default. With index, elements are single combinations whose
+    offsets are written to the index_path() of the output file.
+    """
+    framing = framing or array_framing()
+    if output is None:
+        output = args.output
+    if output is None:
+        if index:
+            log.error("An indexed output requires an output file (--output)")
+            raise OutputWriteError("Indexed output to stdout")
+        # dump to stdout
+        with open_output(None, compress) as output_file:
+            dump_json_chunks(elements, output_file, framing)
+            if not framing[2].endswith('\n'):
+                output_file.write('\n')
+        sys.stdout.flush()
+    else:
+        with OutputFile(output, framing, compress, index) as output_file:
+            for chunk in elements:
+                output_file.write(chunk)
+
+def dump_partitions(param_sets, assignment, partitions, format = "readable"):
+    """Write each combination to the output of its partition, in order
+
+    assignment is the partition of each combination, as by
+    partition_costs(), the skipped ones being in none. The combinations are
+    expanded once for up to PARTITION_OUTPUTS outputs, open at once.
+    """
+    framing = output_framing(param_sets, format)
+    for first in range(0, partitions, PARTITION_OUTPUTS):
+        group = range(first, min(first + PARTITION_OUTPUTS, partitions))
+        with contextlib.ExitStack() as stack:
+            outputs = [ stack.enter_context(OutputFile(
+                            partition_path(args.output, p + 1), framing,
+                            args.gzip, args.index)) for p in group ]
+            ids = None
+            if args.ids is not None:
+                ids = [ stack.enter_context(
+                            open_ids(partition_path(args.ids, p + 1)))
+                        for p in group ]
+
+            def routed():
+                for k, combination in enumerate(expand_sets(param_sets)):
+                    if assignment[k] in group:
+                        if ids is not None:
+                            ids[assignment[k] - first].write(
+                                combination.content_id() + "\n")
+                        yield combination
+            routes = ( p - first for p in assignment if p in group )
+            for pos, element in zip(routes, output_elements(
+                    param_sets, routed(), format)):
+                outputs[pos].write(element)
+
+def remove_files(paths):
+    """Remove the files that exist among paths"""
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+class IndexedOutput:
+    """Read the combinations of an output written with --index
+
+    The output and its index are memory-mapped: combination k is parsed
+    from its own bytes, at the offsets read from the index, so a lookup
+    costs the same whatever the number of combinations. Combinations are
+    returned as in the readable output, lists of single-value params,
+    whatever the --format of the output.
+    """
+
+    def __init__(self, output):
+        import mmap
+
+        self.output = output
+        self._maps = []
+        try:
+            for path in [ output, index_path(output) ]:
+                with open(path, mode="rb") as map_fp:
+                    if os.fstat(map_fp.fileno()).st_size == 0:
+                        # empty files can not be mapped
+                        self._maps.append(b"")
+                    else:
+                        self._maps.append(mmap.mmap(map_fp.fileno(), 0,
+                                                    access = mmap.ACCESS_READ))
+        except OSError as e:
+            self.close()
+            raise OutputIndexError("Failed to open the indexed output %s: %s"
+                                   % (output, e)) from e
+        self._data, self._index = self._maps
+
+        try:
+            magic, self._count, size = INDEX_HEADER.unpack_from(self._index)
+        except struct.error:
+            magic = None
+        if magic != INDEX_MAGIC or size != len(self._data) or \
+                len(self._index) != INDEX_HEADER.size + \
+                self._count * INDEX_ENTRY.size:
+            self.close()
+            raise OutputIndexError("The index of %s is invalid, or does not"
+                                   " match the output" % output)
+
+        # columnar outputs: the params of the rows, before the first row
+        self._columns = None
+        if self._count > 0 and self._data[:1] == b"{":
+            header = self._data[:self._offsets(0)[0]].decode("ascii")
+            self._columns = json.JSONDecoder().raw_decode(
+                header, header.index("["))[0]
+
+    def _offsets(self, k):
+        return INDEX_ENTRY.unpack_from(self._index,
+                                       INDEX_HEADER.size + k * INDEX_ENTRY.size)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, k):
+        """Return combination k (negative k counting from the end)"""
+        if k < 0:
+            k += self._count
+        if not 0 <= k < self._count:
+            raise IndexError("combination %d out of range" % k)
+        start, end = self._offsets(k)
+        combination = json.loads(self._data[start:end])
+        if self._columns is not None:
+            combination = [ dict(column, val = val) for column, val in
+                            zip(self._columns, combination) if val is not None ]
+        return combination
+
+    def close(self):
+        """Unmap the output and its index"""
+        for mapped in self._maps:
+            if not isinstance(mapped, bytes):
+                mapped.close()
+        self._maps = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def main():
+    """Main function of multiplex"""
+
+    global args
+    global log
+
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
+    else:
+        logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    log = logging.getLogger(__name__)
+
+    if args.manifest is not None or len(args.inputs) > 1:
+        return run_batch()
+
+    input_json = load_json_file(args.input)
+
+    if input_json is None:
+        return EC_JSON_FAIL
+
+    directory = None if args.no_cache else cache_dir()
+    marker, trusted = None, False
+    if args.trusted and directory is not None:
+        marker, trusted = validated_input(args.input, directory)
+    if trusted:
+        log.debug("Input %s validated before, skipping its validation",
+                  args.input)
+    else:
+        if not validate_schema(input_json, "schema.json"):
+            return EC_SCHEMA_FAIL
+        if marker is not None:
+            mark_validated(marker)
+
+    strategy = args.strategy if args.t_wise is None else args.t_wise
+    try:
+        multiplexer = load_multiplexer(args.req, strategy, directory)
+        if multiplexer is None:
+            return EC_REQUIREMENTS_FAIL
+        return run(input_json, multiplexer)
+    except MultiplexError as e:
+        # already logged where detected
+        return e.exit_code
+
+def run(input_json, multiplexer):
+    """Expand a validated input as requested by the command line options"""
+    # validate and transform all the sets before expanding any of them
+    param_sets = multiplexer.prepare(input_json, validate = False)
+
+    costs = []
+    if args.order != "product":
+        costs = multiplexer.order(param_sets, args.order)
+        log.info("Reconfiguration cost: %s in product order, %s in %s order.",
+                 sum(c[0] for c in costs), sum(c[1] for c in costs), args.order)
+
+    total = sum(param_set.count() for param_set in param_sets)
+    start, stop = select_range(total, args.shard, args.index_range)
+    selected = stop - start
+
+    # combinations not output: duplicates (--dedup) and completed ones
+    dedup = None
+    completed = None
+    if args.dedup:
+        # combinations before the selected ones are seen, not output
+        dedup = Deduplicator(param_sets)
+        dedup.skip(expand_sets(param_sets, 0, start))
+    if args.completed is not None:
+        completed = load_completed(args.completed)
+        if completed is None:
+            return EC_COMPLETED_FAIL
+
+    def is_pending(combination):
+        if dedup is not None and not dedup.is_new(combination):
+            return False
+        return completed is None or completed.is_pending(combination)
+
+    skipped = None
+    if (dedup is not None or completed is not None) and (
+            args.partitions is not None or args.dry_run or args.count or
+            args.max_combinations is not None):
+        # the skipped combinations are needed up front, else they are
+        # dropped while streaming the output
+        skipped = { k for k, combination in
+                    enumerate(expand_sets(param_sets, start, stop))
+                    if not is_pending(combination) }
+        selected -= len(skipped)
+        log_skipped(dedup, completed)
+
+    if args.partitions is not None:
+        assignment, loads = partition_costs(multiplexer.costs(param_sets),
+                                            args.partitions, skipped or ())
+        partitions = []
+        for p, load in enumerate(loads):
+            partitions.append({ "partition": p + 1, "cost": load,
+                                "combinations": assignment.count(p) })
+            log.info("Partition %d: %d combinations, predicted cost %s.",
+                     p + 1, partitions[-1]["combinations"], load)
+        log.info("Predicted makespan: %s.", max(loads))
+
+    if args.dry_run:
+        # the combinations written by the run, in one output per partition
+        outputs = None
+        if args.partitions is not None:
+            outputs = [ partition["combinations"] for partition in partitions ]
+        report = count_sets(param_sets, format = args.format, start = start,
+                            stop = stop, outputs = outputs,
+                            skipped = { start + k for k in skipped or () })
+        for set_report, (before, after) in zip(report["sets"], costs):
+            set_report["reconfiguration-cost"] = { "before": before,
+                                                   "after": after }
+        if dedup is not None:
+            for set_report, count in zip(report["sets"], dedup.duplicates):
+                set_report["duplicates"] = count
+            report["duplicates"] = sum(dedup.duplicates)
+        if completed is not None:
+            report["completed"] = completed.skipped
+        if args.partitions is not None:
+            report["partitions"] = partitions
+            report["makespan"] = max(loads)
+        if costs:
+            report["reconfiguration-cost"] = {
+                "before": sum(c[0] for c in costs),
+                "after": sum(c[1] for c in costs) }
+        if (start, stop) != (0, total):
+            report["selected"] = { "start": start, "stop": stop }
+        print(dump_json(report))
+    elif args.count:
+        print(selected)
+
+    if args.max_combinations is not None and selected > args.max_combinations:
+        log.error("The input expands to %d combinations, over the budget"
+                  " of %d (--max-combinations)."
+                  % (selected, args.max_combinations))
+        return EC_MAX_COMBINATIONS_FAIL
+    if args.dry_run or args.count:
+        return EC_SUCCESS
+
+    if args.partitions is not None:
+        dump_partitions(param_sets, assignment, args.partitions, args.format)
+        return EC_SUCCESS
+
+    framing = output_framing(param_sets, args.format)
+
+    if (args.jobs or 1) > 1 and dedup is None and completed is None and \
+            args.ids is None and not args.index:
+        if selected >= PARALLEL_MIN_COMBINATIONS:
+            chunks = expand_parallel(param_sets, args.format, start, stop,
+                                     args.jobs)
+            dump_output(chunks, None, framing, args.gzip)
+            return EC_SUCCESS
+        log.debug("Expanding %d combinations serially, under %d.",
+                  selected, PARALLEL_MIN_COMBINATIONS)
+
+    multiplexed_json = expand_sets(param_sets, start, stop)
+    if skipped is not None:
+        multiplexed_json = ( combination for k, combination in
+                             enumerate(multiplexed_json)
+                             if k not in skipped )
+    elif dedup is not None or completed is not None:
+        multiplexed_json = filter(is_pending, multiplexed_json)
+    if args.ids is not None:
+        multiplexed_json = write_ids(multiplexed_json, args.ids)
+    dump_output(output_elements(param_sets, multiplexed_json, args.format),
+                None, framing, args.gzip, args.index)
+    if skipped is None:
+        log_skipped(dedup, completed)
+
+    return EC_SUCCESS
+
+_worker_sets = None
+
+def portable_set(param_set):
+    """Return a prepared set to send to an expansion process
+
+    The constraint checks of a set (closures) do not pickle: a constrained
+    set is sent without them, its combinations being sent with the tasks.
+    """
+    if param_set.checks is None:
+        return param_set
+    portable = ParamSet(param_set.records, param_set.links)
+    portable.total = param_set.count()
+    return portable
+
+def init_expand_worker(param_sets):
+    """Start an expansion process with the sets prepared by the parent"""
+    global _worker_sets
+
+    _worker_sets = param_sets
+
+def expand_chunk(start, stop, format):
+    """Return the dumped combinations of the worker sets, from start to stop"""
+    sep = output_framing(_worker_sets, format)[1]
+    return sep.join(output_elements(_worker_sets, expand_sets(_worker_sets,
+                                                              start, stop),
+                                    format))
+
+def expand_rows(set_idx, rows, format):
+    """Return the dumped combinations of a worker set, from the val indexes
+    of its params"""
+    records = _worker_sets[set_idx].records
+    sep = output_framing(_worker_sets, format)[1]
+    return sep.join(output_elements(_worker_sets,
+                                    ( Combination(records, idx)
+                                      for idx in rows ), format))
+
+def parallel_tasks(param_sets, start, stop):
+    """Yield the tasks expanding the combinations from start to stop
+
+    Each task is a function and its arguments, but the format: a range of
+    PARALLEL_CHUNK combinations in a set, or the val indexes of as many
+    combinations of a constrained set, walked once by this process (a range
+    would walk its constrained product from the start of the set).
+    """
+    offset = 0
+    for set_idx, param_set in enumerate(param_sets):
+        count = param_set.count()
+        set_start = max(start - offset, 0)
+        set_stop = min(stop - offset, count)
+        if set_start < set_stop and param_set.checks is not None:
+            selection = itertools.islice(param_set.selection(), set_start,
+                                         set_stop)
+            while True:
+                rows = list(itertools.islice(selection, PARALLEL_CHUNK))
+                if len(rows) == 0:
+                    break
+                yield expand_rows, (set_idx, rows)
+        elif set_start < set_stop:
+            for chunk_start in range(offset + set_start, offset + set_stop,
+                                     PARALLEL_CHUNK):
+                yield expand_chunk, (chunk_start,
+                                     min(chunk_start + PARALLEL_CHUNK,
+                                         offset + set_stop))
+        offset += count
+
+def expand_parallel(param_sets, format, start, stop, jobs):
+    """Yield chunks of dumped combinations, expanded by several processes
+
+    The processes get the sets as prepared (and ordered) by this process,
+    and dump the combinations of parallel_tasks(); the chunks are yielded
+    in order, a few tasks ahead of the one being written.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    initargs = ([ portable_set(param_set) for param_set in param_sets ],)
+    with ProcessPoolExecutor(max_workers = jobs,
+                             initializer = init_expand_worker,
+                             initargs = initargs) as executor:
+        pending = []
+        for function, task_args in parallel_tasks(param_sets, start, stop):
+            pending.append(executor.submit(function, *task_args, format))
+            if len(pending) > 2 * jobs:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+def batch_jobs():
+    """Return the options of each input of a batch, and an exit code"""
+    if args.manifest is None:
+        entries = [ { "input": path } for path in args.inputs ]
+        if args.output is not None:
+            for entry in entries:
+                entry["output"] = os.path.join(args.output,
+                                               os.path.basename(entry["input"]))
+    else:
+        entries = load_json_file(args.manifest)
+        if entries is None:
+            return None, EC_JSON_FAIL
+        if not validate_schema(entries, "manifest-schema.json"):
+            return None, EC_SCHEMA_FAIL
+        # paths relative to the manifest
+        base = os.path.dirname(args.manifest)
+        entries = [ { key: os.path.join(base, path)
+                      for key, path in entry.items() } for entry in entries ]
+
+    jobs = []
+    for entry in entries:
+        job = copy.copy(args)
+        job.manifest = None
+        job.inputs = [ entry["input"] ]
+        job.input = entry["input"]
+        job.req = entry.get("requirements", args.req)
+        job.output = entry.get("output")
+        # the inputs are already run in parallel
+        job.jobs = 1
+        jobs.append(job)
+    return jobs, EC_SUCCESS
+
+class RecordHandler(logging.Handler):
+    """Log handler keeping the records, to replay them in another process"""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        # merge the message and exception, as logging.handlers.QueueHandler
+        # does, so the record pickles
+        self.format(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+
+def run_job(job):
+    """Multiplex one input of a batch, return its exit code and the file of
+    its stdout
+
+    The stdout is streamed to a temporary file, written out and removed by
+    emit_job(), so a large output is neither kept in memory nor sent back
+    from a batch process.
+    """
+    global args
+    import tempfile
+
+    args = job
+    # the logs of the requirements, compiled once by run_batch()
+    for record in job.replay:
+        logging.getLogger(record.name).handle(record)
+    with tempfile.NamedTemporaryFile(mode="w", encoding="utf-8",
+                                     prefix="multiplex-", suffix=".out",
+                                     delete=False) as stdout:
+        try:
+            with contextlib.redirect_stdout(stdout):
+                code = main()
+        except Exception:
+            log.exception("Failed to multiplex %s" % (job.input))
+            code = EC_UNEXPECTED_FAIL
+    return code, stdout.name
+
+def init_batch_worker(compiled):
+    """Start a batch process with the requirements compiled by the batch"""
+    for key, requirements in compiled:
+        _multiplexers[key] = Multiplexer.from_compiled(requirements, key[1])
+
+def run_batch():
+    """Multiplex the inputs of a batch in parallel, as separate runs would
+
+    The outputs are written in the order of the inputs, and the exit code
+    of each input is logged; the batch fails with the first failure code.
+    """
+    global args
+
+    jobs, code = batch_jobs()
+    if jobs is None:
+        return code
+
+    # compile each requirements file once for all the inputs, its warnings
+    # replayed by the run of each input, as separate runs would log them;
+    # failures are reported by the runs of the inputs
+    strategy = args.strategy if args.t_wise is None else args.t_wise
+    directory = None if args.no_cache else cache_dir()
+    root = logging.getLogger()
+    saved_handlers = root.handlers
+    replays = {}
+    try:
+        for req in dict.fromkeys(job.req for job in jobs):
+            root.handlers = [ RecordHandler() ]
+            try:
+                if load_multiplexer(req, strategy, directory) is not None:
+                    replays[req] = root.handlers[0].records
+            except MultiplexError:
+                pass
+    finally:
+        root.handlers = saved_handlers
+    for job in jobs:
+        job.replay = replays.get(job.req, [])
+
+    workers = min(args.jobs or os.cpu_count() or 1, len(jobs))
+    batch_args = args
+    try:
+        if workers == 1:
+            results = map(run_job, jobs)
+            codes = [ emit_job(result) for result in results ]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            compiled = [ (key, multiplexer.compiled())
+                         for key, multiplexer in _multiplexers.items() ]
+            with ProcessPoolExecutor(max_workers = workers,
+                                     initializer = init_batch_worker,
+                                     initargs = (compiled,)) as executor:
+                codes = [ emit_job(result)
+                          for result in executor.map(run_job, jobs) ]
+    finally:
+        args = batch_args
+
+    for job, job_code in zip(jobs, codes):
+        if job_code == EC_SUCCESS:
+            log.info("%s: exit code %d", job.input, job_code)
+        else:
+            log.error("%s: exit code %d", job.input, job_code)
+    failed = [ job_code for job_code in codes if job_code != EC_SUCCESS ]
+    log.info("Batch: %d inputs, %d failed.", len(jobs), len(failed))
+    return failed[0] if failed else EC_SUCCESS
+
+def emit_job(result):
+    """Write the stdout of a batch input, return its exit code"""
+    import shutil
+
+    code, stdout_file = result
+    try:
+        with open(stdout_file, mode="rb") as stdout:
+            sys.stdout.flush()
+            shutil.copyfileobj(stdout, sys.stdout.buffer)
+            sys.stdout.buffer.flush()
+    finally:
+        os.remove(stdout_file)
+    return code
+
+class ChannelWriter(io.RawIOBase):
+    """Binary stream sent as frames of one channel of a service response"""
+
+    def __init__(self, sock, channel):
+        self.sock = sock
+        self.channel = channel
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if len(data):
+            self.sock.sendall(SERVICE_FRAME.pack(self.channel, len(data)))
+            self.sock.sendall(data)
+        return len(data)
+
+def serve_request(argv, cwd, stdout, stderr):
+    """Run a command line in the service process, return its exit code"""
+    global args
+
+    root = logging.getLogger()
+    saved_handlers, saved_level = root.handlers, root.level
+    handler = logging.StreamHandler(stderr)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    root.handlers = [ handler ]
+    saved_cwd = os.getcwd()
+    try:
+        with contextlib.redirect_stdout(stdout), \
+             contextlib.redirect_stderr(stderr):
+            try:
+                os.chdir(cwd)
+                args = process_options(argv)
+                root.setLevel(logging.DEBUG if args.debug else logging.INFO)
+                if args.serve is not None:
+                    log.error("A service does not start services (--serve)")
+                    return EC_SERVICE_FAIL
+                return main()
+            except SystemExit as e:
+                # argparse errors and --help
+                return e.code if isinstance(e.code, int) else 1
+            except Exception:
+                log.exception("Failed to run %s" % (argv))
+                return EC_UNEXPECTED_FAIL
+    finally:
+        os.chdir(saved_cwd)
+        root.handlers, root.level = saved_handlers, saved_level
+
+class ServiceHandler:
+    """One command line per connection, answered as framed output
+
+    The request handler of the socketserver of make_service(), not derived
+    from its handlers so socketserver is only imported by the service.
+    """
+
+    def __init__(self, connection, client_address, server):
+        self.connection = connection
+        with connection.makefile('rb') as self.rfile:
+            self.handle()
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # a probe of make_service(), no command line
+            return
+        request = json.loads(line)
+        stdout = io.TextIOWrapper(io.BufferedWriter(
+            ChannelWriter(self.connection, b'o')), encoding="utf-8")
+        stderr = io.TextIOWrapper(io.BufferedWriter(
+            ChannelWriter(self.connection, b'e')), encoding="utf-8")
+        code = serve_request(request["argv"], request["cwd"], stdout, stderr)
+        stdout.flush()
+        stderr.flush()
+        exit_code = struct.pack("!i", code)
+        self.connection.sendall(SERVICE_FRAME.pack(b'x', len(exit_code)))
+        self.connection.sendall(exit_code)
+
+def make_service(socket_path):
+    """Bind the service to a unix socket, only accessible to the user
+
+    A socket left behind by a stopped service is replaced, but ServiceError
+    is raised for any other file, or the socket of a running service.
+    """
+    import socket
+    import socketserver
+
+    try:
+        mode = os.stat(socket_path).st_mode
+    except FileNotFoundError:
+        mode = None
+    if mode is not None:
+        if not stat.S_ISSOCK(mode):
+            log.error("%s exists and is not a socket.", socket_path)
+            raise ServiceError("%s is not a socket" % socket_path)
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except OSError:
+            # left behind by a stopped service
+            os.remove(socket_path)
+        else:
+            log.error("A service is already running on %s.", socket_path)
+            raise ServiceError("A service is running on %s" % socket_path)
+        finally:
+            probe.close()
+    umask = os.umask(0o077)
+    try:
+        return socketserver.UnixStreamServer(socket_path, ServiceHandler)
+    finally:
+        os.umask(umask)
+
+def serve(socket_path):
+    """Answer the command lines of the clients, one at a time, until stopped"""
+    global log
+
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    log = logging.getLogger(__name__)
+    try:
+        service = make_service(socket_path)
+    except ServiceError as e:
+        return e.exit_code
+    # stop on SIGTERM as on ^C, removing the socket
+    import signal
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    log.info("Serving on %s.", socket_path)
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.server_close()
+        os.remove(socket_path)
+    return EC_SUCCESS
+
+def cli(argv = None):
+    """Run the command line (sys.argv by default), return its exit code"""
+    global args
+
+    args = process_options(argv)
+    if args.serve is not None:
+        return serve(args.serve)
+    return main()
+
+if __name__ == "__main__":
+    exit(cli())
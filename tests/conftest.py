@@ -0,0 +1,9 @@
+#!/usr/bin/env python3
+
+import pytest
+import multiplex
+
+"""Common function to keep the cache of the command lines in tmp_path"""
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv(multiplex.CACHE_ENV, str(tmp_path / "cache"))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+import pytest
+import json
+import threading
+import multiplex
+
+class TestMultiplexer:
+
+    # helper function to load a json file of the tests
+    def _load(self, filename):
+        return multiplex.load_json_file("tests/JSON/" + filename)
+
+    """Test if expand() returns the combinations of the command line"""
+    def test_expand(self):
+        multiplexer = multiplex.Multiplexer(self._load("requirements-pass.json"))
+        input_json = self._load("multi-params-sets.json")
+        combinations = multiplexer.expand(input_json)
+        assert not isinstance(combinations, list)
+        combinations = list(combinations)
+        # the essentials preset overrides bs, then validated and converted
+        assert combinations == [
+            [ { "arg": "rw", "role": "client", "val": rw },
+              { "arg": "ioengine", "role": "client", "val": "sync" },
+              { "arg": "bs", "role": "client", "val": "1KiB" },
+              { "arg": "duration", "role": "client", "val": "60" } ]
+            for rw in [ "read", "write" ] ] + [
+            [ { "arg": "rw", "role": "client", "val": rw },
+              { "arg": "bs", "role": "client", "val": "1KiB" },
+              { "arg": "duration", "role": "client", "val": "60" } ]
+            for rw in [ "read", "write" ] ]
+        assert list(multiplexer.expand(input_json, 1, 3)) == combinations[1:3]
+        # the input is left untouched, and can be expanded again
+        assert input_json == self._load("multi-params-sets.json")
+        assert list(multiplexer.expand(input_json)) == combinations
+
+    """Test if the multiplexers do not share nor modify the module state"""
+    def test_instance_state(self):
+        multiplex.validation_dict = {}
+        multiplex.presets_dict = {}
+        input_json = self._load("multi-params-sets.json")
+        plain = multiplex.Multiplexer()
+        required = multiplex.Multiplexer(self._load("requirements-pass.json"))
+        assert len(list(plain.expand(input_json))) == 6
+        assert len(list(required.expand(input_json))) == 4
+        assert len(list(plain.expand(input_json))[0]) == 2
+        assert multiplex.validation_dict == {}
+        assert multiplex.presets_dict == {}
+
+        constrained = multiplex.Multiplexer(
+            self._load("requirements-constraints.json"))
+        assert constrained.constraints
+
+    """Test if the failures raise typed exceptions, not SystemExit"""
+    def test_errors(self):
+        requirements = self._load("requirements-pass.json")
+        with pytest.raises(multiplex.RequirementsSchemaError) as e:
+            multiplex.Multiplexer({ "presets": {} })
+        assert e.value.exit_code == multiplex.EC_REQ_SCHEMA_FAIL
+
+        multiplexer = multiplex.Multiplexer(requirements)
+        with pytest.raises(multiplex.SchemaError) as e:
+            multiplexer.expand({ "sets": "none" })
+        assert e.value.exit_code == multiplex.EC_SCHEMA_FAIL
+
+        invalid = { "sets": [ { "params": [
+            { "arg": "ioengine", "vals": [ "sync", "io_uring" ] } ] } ] }
+        with pytest.raises(multiplex.ParamValidationError) as e:
+            multiplexer.expand(invalid)
+        assert e.value.exit_code == multiplex.EC_VALIDATIONS_FAIL
+        assert isinstance(e.value, multiplex.MultiplexError)
+
+        empty = self._load("empty-params-sets-and-global.json")
+        with pytest.raises(multiplex.EmptySetError):
+            multiplex.Multiplexer(self._load(
+                "requirements-presets-empty-pass.json")).expand(empty)
+
+    """Test if one multiplexer expands inputs from several threads"""
+    def test_threads(self):
+        multiplexer = multiplex.Multiplexer(self._load("requirements-pass.json"))
+        inputs = [ self._load(name) for name in
+                   [ "multi-params-sets.json", "params-ids.json",
+                     "include-global-multi.json" ] ]
+        expected = [ json.dumps(list(multiplexer.expand(input_json)))
+                     for input_json in inputs ]
+        results = {}
+
+        def expand(n):
+            input_json = inputs[n % len(inputs)]
+            results[n] = json.dumps(list(multiplexer.expand(input_json)))
+
+        threads = [ threading.Thread(target=expand, args=(n,))
+                    for n in range(12) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert [ results[n] for n in range(12) ] == \
+            [ expected[n % len(inputs)] for n in range(12) ]
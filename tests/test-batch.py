@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import pytest
+import os
+import sys
+import json
+import gzip
+import subprocess
+import multiplex
+
+class TestBatch:
+
+    inputs = [ "tests/JSON/multi-params-sets.json", "JSON/mv-params-input.json",
+               "tests/JSON/params-ids.json" ]
+    requirements_json = "tests/JSON/requirements-pass.json"
+
+    # helper function to run the command line in a new process
+    def _run(self, argv):
+        return subprocess.run([ sys.executable, os.path.abspath("multiplex.py") ]
+                              + argv, capture_output=True)
+
+    """Test if a batch outputs the same as separate runs, in order"""
+    @pytest.mark.parametrize("jobs", [ "1", "2" ])
+    def test_batch_stdout(self, jobs):
+        expected = b"".join(self._run([ "--input", path, "--requirements",
+                                        self.requirements_json ]).stdout
+                            for path in self.inputs)
+        result = self._run([ "--jobs", jobs, "--requirements",
+                             self.requirements_json, "--input" ] + self.inputs)
+        assert result.returncode == multiplex.EC_SUCCESS
+        assert result.stdout == expected
+        assert b"Batch: 3 inputs, 0 failed." in result.stderr
+
+    """Test if the outputs of a batch are named after the inputs"""
+    def test_batch_output(self, tmp_path):
+        result = self._run([ "--output", str(tmp_path), "--input" ] + self.inputs)
+        assert result.returncode == multiplex.EC_SUCCESS
+        for path in self.inputs:
+            expected = self._run([ "--input", path ]).stdout
+            output = tmp_path / os.path.basename(path)
+            assert output.read_bytes() + b"\n" == expected
+
+        # outputs of the same name, or not in a directory
+        assert self._run([ "--output", str(tmp_path), "--input", self.inputs[0],
+                           self.inputs[0] ]).returncode == 2
+        assert self._run([ "--output", str(output), "--input" ] +
+                         self.inputs).returncode == 2
+        assert self._run([ "--ids", "ids", "--input" ] +
+                         self.inputs).returncode == 2
+
+    """Test if a manifest sets the requirements and output of each input"""
+    def test_manifest(self, tmp_path):
+        manifest = tmp_path / "manifest.json"
+        manifest.write_text(json.dumps([
+            { "input": os.path.abspath(self.inputs[0]),
+              "requirements": os.path.abspath(self.requirements_json),
+              "output": "first.json" },
+            { "input": os.path.abspath("tests/JSON/params-ids-invalid.json") },
+            { "input": "missing.json" },
+            { "input": os.path.abspath(self.inputs[1]) } ]))
+        result = self._run([ "--jobs", "2", "--manifest", str(manifest) ])
+        # the first failure, in the order of the inputs
+        assert result.returncode == multiplex.EC_SCHEMA_FAIL
+        assert (tmp_path / "first.json").read_bytes() + b"\n" == self._run(
+            [ "--input", self.inputs[0], "--requirements",
+              self.requirements_json ]).stdout
+        assert result.stdout == self._run([ "--input", self.inputs[1] ]).stdout
+        summary = [ line.split(b":  ")[1] for line in result.stderr.splitlines()
+                    if b": exit code" in line ]
+        assert [ line.rsplit(b" ", 1)[1] for line in summary ] == \
+            [ b"0", b"1", b"2", b"0" ]
+        assert b"Batch: 4 inputs, 2 failed." in result.stderr
+
+        manifest.write_text(json.dumps([ { "inputs": "a.json" } ]))
+        assert self._run([ "--manifest", str(manifest) ]).returncode == \
+            multiplex.EC_SCHEMA_FAIL
+
+    """Test if the warnings of the requirements are logged for each input"""
+    @pytest.mark.parametrize("jobs", [ "1", "2" ])
+    def test_requirements_warnings(self, jobs, tmp_path):
+        with open(self.requirements_json) as req_fp:
+            req_json = json.load(req_fp)
+        del req_json["units"]
+        requirements = tmp_path / "requirements.json"
+        requirements.write_text(json.dumps(req_json))
+        warning = b"The 'units' section has not been found"
+        single = self._run([ "--no-cache", "--requirements", str(requirements),
+                             "--input", self.inputs[0] ])
+        assert single.stderr.count(warning) > 0
+        result = self._run([ "--no-cache", "--jobs", jobs, "--requirements",
+                             str(requirements), "--input" ] + self.inputs)
+        assert result.returncode == multiplex.EC_SUCCESS
+        assert result.stderr.count(warning) == \
+            len(self.inputs) * single.stderr.count(warning)
+
+    """Test if the stdout of a batch input goes through a removed temporary file"""
+    def test_run_job(self, capsys, monkeypatch):
+        monkeypatch.setattr(multiplex, "args", None, raising=False)
+        job = multiplex.process_options([ "--input", self.inputs[1] ])
+        job.replay = []
+        code, stdout_file = multiplex.run_job(job)
+        assert code == multiplex.EC_SUCCESS
+        assert os.path.exists(stdout_file)
+        assert multiplex.emit_job((code, stdout_file)) == multiplex.EC_SUCCESS
+        assert not os.path.exists(stdout_file)
+        assert capsys.readouterr().out.encode() == \
+            self._run([ "--input", self.inputs[1] ]).stdout
+
+        # an unexpected exception has its own exit code
+        def fail():
+            print("partial")
+            raise RuntimeError("unexpected")
+        monkeypatch.setattr(multiplex, "main", fail)
+        code, stdout_file = multiplex.run_job(job)
+        assert code == multiplex.EC_UNEXPECTED_FAIL
+        assert multiplex.emit_job((code, stdout_file)) == \
+            multiplex.EC_UNEXPECTED_FAIL
+        assert not os.path.exists(stdout_file)
+        assert capsys.readouterr().out == "partial\n"
+
+    """Test if gzip outputs are the same compressed bytes, in and out of batches"""
+    def test_gzip(self, tmp_path):
+        expected = self._run([ "--input", self.inputs[0], "--format", "ndjson" ])
+        result = self._run([ "--input", self.inputs[0], "--format", "ndjson",
+                             "--gzip" ])
+        assert result.returncode == multiplex.EC_SUCCESS
+        assert gzip.decompress(result.stdout) == expected.stdout
+        assert self._run([ "--output", str(tmp_path), "--format", "ndjson",
+                           "--gzip", "--input" ] + self.inputs).returncode == \
+            multiplex.EC_SUCCESS
+        assert (tmp_path / os.path.basename(self.inputs[0])).read_bytes() == \
+            result.stdout
+
+        assert self._run([ "--gzip", "--input" ] + self.inputs).returncode == 2
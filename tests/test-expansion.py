@@ -0,0 +1,646 @@
+#!/usr/bin/env python3
+
+import pytest
+import io
+import os
+import json
+import itertools
+import math
+import multiplex
+
+class TestExpansion:
+
+    # helper function to prepare the sets of an input file
+    def _prepare(self, filename, strategy = None, multiplexer = None):
+        input_json = multiplex.load_json_file("tests/JSON/" + filename)
+        if multiplexer is None:
+            multiplexer = multiplex.Multiplexer(strategy = strategy)
+        return multiplexer.prepare(input_json, validate = False)
+
+    # helper function to build a multiplexer from a requirements file
+    def _multiplexer(self, filename):
+        req_json = multiplex.load_json_file("tests/JSON/" + filename)
+        return multiplex.Multiplexer(req_json)
+
+    # helper function to check that rows cover all the t-tuples of vals
+    def _covers(self, radices, strength, rows):
+        for cols in itertools.combinations(range(len(radices)), strength):
+            tuples = { tuple(idx[c] for c in cols) for idx in rows }
+            if len(tuples) != math.prod(radices[c] for c in cols):
+                return False
+        return True
+
+    # helper function to check that rows cover the t-tuples of valid vals
+    def _covers_valid(self, valid, strength, rows):
+        for cols in itertools.combinations(range(len(valid[0])), strength):
+            tuples = { tuple(idx[c] for c in cols) for idx in rows }
+            if tuples != { tuple(idx[c] for c in cols) for idx in valid }:
+                return False
+        return set(rows) <= set(valid)
+
+    # helper function to dump the readable output of prepared sets
+    def _dump(self, param_sets):
+        stream = io.StringIO()
+        multiplex.dump_json_stream(
+            multiplex.convert_vals(multiplex.expand_sets(param_sets)), stream)
+        return stream.getvalue()
+
+    # helper function to dump the output of prepared sets in a format
+    def _dump_format(self, param_sets, format):
+        stream = io.StringIO()
+        multiplex.dump_json_chunks(
+            multiplex.output_elements(param_sets,
+                                      multiplex.expand_sets(param_sets), format),
+            stream, multiplex.output_framing(param_sets, format))
+        return stream.getvalue()
+
+    """Test if sets are counted without expanding them"""
+    def test_count_sets(self):
+        param_sets = self._prepare("multi-params-sets.json")
+        report = multiplex.count_sets(param_sets)
+        assert [ s["combinations"] for s in report["sets"] ] == [ 2, 4 ]
+        assert report["combinations"] == 6
+        assert report["sets"][1]["multipliers"] == [
+            { "arg": "rw", "role": "client", "id": "1", "vals": 2 },
+            { "arg": "bs", "role": "client", "id": "1", "vals": 2 } ]
+        # rw doubles both sets: 1 + 2 combinations, bs doubles the 2nd: 2
+        assert report["multipliers"][0] == { "arg": "rw", "role": "client",
+                                             "id": "1", "combinations": 3 }
+
+    """Test if the estimated output size is the actual one"""
+    @pytest.mark.parametrize("filename", [ "multi-params-sets.json",
+                                           "params-ids.json",
+                                           "dup-param-diff-role.json" ])
+    def test_output_bytes(self, filename):
+        param_sets = self._prepare(filename)
+        report = multiplex.count_sets(param_sets)
+        assert report["output-bytes"] == len(self._dump(param_sets))
+
+    """Test if the estimated output size is the actual one in each format"""
+    @pytest.mark.parametrize("format", multiplex.OUTPUT_FORMATS)
+    @pytest.mark.parametrize("filename", [ "multi-params-sets.json",
+                                           "params-ids.json",
+                                           "linked-sets.json" ])
+    def test_output_bytes_format(self, filename, format):
+        for param_sets in [ self._prepare(filename),
+                            self._prepare(filename, "pairwise"), [] ]:
+            report = multiplex.count_sets(param_sets, format = format)
+            assert report["output-bytes"] == \
+                len(self._dump_format(param_sets, format))
+
+    """Test if the estimated output size is the one of the selected combinations"""
+    @pytest.mark.parametrize("format", multiplex.OUTPUT_FORMATS)
+    def test_output_bytes_selected(self, format):
+        param_sets = self._prepare("duplicate-sets.json")
+        combinations = list(multiplex.expand_sets(param_sets))
+        dedup = multiplex.Deduplicator(param_sets)
+        skipped = { k for k, c in enumerate(combinations) if not dedup.is_new(c) }
+        assert len(skipped) > 0
+        for start, stop in [ (0, len(combinations)), (1, 4), (2, 2) ]:
+            written = [ c for k, c in enumerate(combinations)
+                        if start <= k < stop and k not in skipped ]
+            stream = io.StringIO()
+            multiplex.dump_json_chunks(
+                multiplex.output_elements(param_sets, written, format), stream,
+                multiplex.output_framing(param_sets, format))
+            report = multiplex.count_sets(param_sets, format = format,
+                                          start = start, stop = stop,
+                                          skipped = skipped)
+            assert report["combinations"] == len(written)
+            assert report["output-bytes"] == len(stream.getvalue())
+            # the same combinations in two outputs, one of them empty
+            report = multiplex.count_sets(param_sets, format = format,
+                                          start = start, stop = stop,
+                                          skipped = skipped,
+                                          outputs = [ len(written), 0 ])
+            assert report["output-bytes"] == len(stream.getvalue()) + \
+                len(multiplex.output_framing(param_sets, format)[3])
+
+    """Test the estimated output size of an empty matrix"""
+    def test_output_bytes_empty(self):
+        report = multiplex.count_sets([])
+        assert report["combinations"] == 0
+        assert report["output-bytes"] == len(self._dump([]))
+
+    """Test if the k-th combination is decoded without expansion"""
+    def test_combination_at(self):
+        param_sets = self._prepare("params-ids.json")
+        expanded = [ c.to_dicts() for c in multiplex.expand_sets(param_sets) ]
+        for k in range(len(expanded)):
+            assert multiplex.combination_at(param_sets, k).to_dicts() == expanded[k]
+        with pytest.raises(IndexError):
+            multiplex.combination_at(param_sets, len(expanded))
+
+    """Test if a range of combinations is generated from its start"""
+    @pytest.mark.parametrize("start,stop", [ (0, 6), (1, 5), (2, 3), (4, 4), (3, 12) ])
+    def test_expand_range(self, start, stop):
+        param_sets = self._prepare("multi-params-sets.json")
+        expanded = [ c.to_dicts() for c in multiplex.expand_sets(param_sets) ]
+        selected = [ c.to_dicts() for c in
+                     multiplex.expand_sets(param_sets, start, stop) ]
+        assert selected == expanded[start:stop]
+
+    """Test if the shards split the combinations in balanced slices"""
+    @pytest.mark.parametrize("total,n", [ (6, 4), (10, 3), (2, 5) ])
+    def test_select_shards(self, total, n):
+        slices = [ multiplex.select_range(total, (i, n)) for i in range(1, n + 1) ]
+        assert slices[0][0] == 0 and slices[-1][1] == total
+        for (_, stop), (start, _) in zip(slices, slices[1:]):
+            assert stop == start
+        sizes = [ stop - start for start, stop in slices ]
+        assert max(sizes) - min(sizes) <= 1
+
+    """Test --shard and --range option parsing"""
+    def test_selection_options(self):
+        assert multiplex.shard_option("2/4") == (2, 4)
+        assert multiplex.range_option("100:") == (100, None)
+        assert multiplex.select_range(50, None, (None, 20)) == (0, 20)
+        assert multiplex.select_range(50, None, (40, 80)) == (40, 50)
+        for shard in [ "0/4", "5/4", "1-4" ]:
+            with pytest.raises(multiplex.argparse.ArgumentTypeError):
+                multiplex.shard_option(shard)
+
+    """Test if the covering arrays cover every t-tuple of vals"""
+    @pytest.mark.parametrize("radices,strength", [ ([3] * 30, 2),
+                                                   ([2, 3, 4, 1, 5, 6], 2),
+                                                   ([3] * 10, 3),
+                                                   ([4, 2, 3, 3], 1) ])
+    def test_covering_array(self, radices, strength):
+        rows = multiplex.covering_array(radices, strength)
+        assert self._covers(radices, strength, rows)
+        assert len(rows) < math.prod(radices)
+        assert len(set(rows)) == len(rows)
+        # deterministic
+        assert multiplex.covering_array(radices, strength) == rows
+
+    """Test if constrained covering arrays cover every valid t-tuple"""
+    @pytest.mark.parametrize("radices,strength", [ ([3] * 4, 2), ([3] * 6, 2),
+                                                   ([2, 4, 3, 1, 3, 2], 2),
+                                                   ([3] * 6, 3) ])
+    def test_covering_array_constraints(self, radices, strength):
+        constraints = [
+            # exclude val 1 of param 0 with val 2 of param 1
+            ((0, 1), lambda idx: not (idx[0] == 1 and idx[1] == 2)),
+            # val 0 of param 2 only with val 0 of param 3
+            ((2, 3), lambda idx: idx[2] != 0 or idx[3] == 0),
+            # params 0, 1 and 4 can not all have the same val
+            ((0, 1, 4), lambda idx: not idx[0] == idx[1] == idx[4]) ]
+        constraints = [ constraint for constraint in constraints
+                        if constraint[0][-1] < len(radices) ]
+        valid = [ idx for idx in itertools.product(*map(range, radices))
+                  if all(check(idx) for _, check in constraints) ]
+        rows = multiplex.covering_array(radices, strength, constraints)
+        assert self._covers_valid(valid, strength, rows)
+        assert len(set(rows)) == len(rows)
+        assert len(rows) < len(valid)
+        assert multiplex.covering_array(radices, strength, constraints) == rows
+
+        # no valid combinations
+        assert multiplex.covering_array(radices, strength,
+                                        [ ((0,), lambda idx: False) ]) == []
+
+    """Test if the full product is kept when t covers all the params"""
+    def test_covering_array_full(self):
+        assert multiplex.covering_array([2, 1, 3], 2) is None
+        assert multiplex.covering_array([1, 1], 1) is None
+
+    """Test if the set strategy and the command line override are applied"""
+    def test_set_strategy(self):
+        param_sets = self._prepare("pairwise-sets.json")
+        # 3-wise of 2 params is the full product
+        assert param_sets[1].rows is None
+        assert param_sets[1].count() == 4
+        pairwise = param_sets[0]
+        assert self._covers(pairwise.radices(), 2, pairwise.rows)
+        assert pairwise.count() < 4 * 3 * 3 * 3 * 2
+        expanded = [ c.to_dicts() for c in multiplex.expand_sets(param_sets) ]
+        assert len(expanded) == multiplex.count_sets(param_sets)["combinations"]
+        for k in range(len(expanded)):
+            assert multiplex.combination_at(param_sets, k).to_dicts() == expanded[k]
+        assert multiplex.count_sets(param_sets)["output-bytes"] == \
+            len(self._dump(param_sets))
+
+        param_sets = self._prepare("pairwise-sets.json", "full")
+        assert [ s.count() for s in param_sets ] == [ 216, 4 ]
+        param_sets = self._prepare("pairwise-sets.json", 1)
+        assert [ s.count() for s in param_sets ] == [ 4, 2 ]
+        assert multiplex.process_options([ "--t-wise", "1" ]).t_wise == 1
+        for t in [ "0", "-1" ]:
+            with pytest.raises(SystemExit):
+                multiplex.process_options([ "--t-wise", t ])
+
+    """Test if constraints prune the same combinations as a post-filter"""
+    def test_constraints(self):
+        param_sets = self._prepare("constraints-sets.json")
+        expanded = [ c.to_dicts() for c in multiplex.expand_sets(param_sets) ]
+
+        def vals(combination, arg, role = "client", id = "1"):
+            return next(p["val"] for p in combination if p["arg"] == arg and
+                        p.get("role", "client") == role and
+                        p.get("id", "1") == id)
+        expected = []
+        for c in itertools.product([ "sync", "libaio" ], [ "1", "8", "32" ],
+                                   [ "read", "randread" ], [ "4096", "65536" ]):
+            if int(c[1]) > 1 and c[0] != "libaio":
+                continue
+            if c[2] == "randread" and c[3] != "4096":
+                continue
+            expected.append(list(c))
+        assert [ [ vals(c, arg) for arg in [ "ioengine", "iodepth", "rw", "bs" ] ]
+                 for c in expanded[:len(expected)] ] == expected
+        # frame-size 9000 only with mtu 9216
+        second = expanded[len(expected):]
+        # (mtu, frame-size): 2 + 3, times 4 ifnames
+        assert len(second) == 5 * 4
+        for c in second:
+            frame = int(vals(c, "frame-size"))
+            assert frame == 64 or frame <= int(vals(c, "mtu", "server"))
+
+        report = multiplex.count_sets(param_sets)
+        assert report["combinations"] == len(expanded)
+        assert report["output-bytes"] == len(self._dump(param_sets))
+        for k in range(len(expanded)):
+            assert multiplex.combination_at(param_sets, k).to_dicts() == expanded[k]
+        assert [ c.to_dicts() for c in
+                 multiplex.expand_sets(param_sets, 5, 15) ] == expanded[5:15]
+
+    """Test if the constraints of the requirements apply to all the sets"""
+    def test_requirements_constraints(self):
+        multiplexer = self._multiplexer("requirements-constraints.json")
+        param_sets = self._prepare("constraints-sets.json",
+                                   multiplexer = multiplexer)
+        # the rule on a missing param does not apply, the ifname one only
+        # to the second set: server ifname id 2 can not be eth1
+        assert param_sets[0].count() == 12
+        assert param_sets[1].count() == 10
+        for c in param_sets[1].combinations():
+            assert c.to_dicts()[3]["val"] == "eth2"
+
+    """Test if constraints apply to the rows of a covering array"""
+    def test_constraints_covering(self):
+        param_sets = self._prepare("constraints-sets.json", "pairwise")
+        for c in multiplex.expand_sets(param_sets[:1]):
+            engine, depth = c.to_dicts()[0]["val"], c.to_dicts()[1]["val"]
+            assert depth == "1" or engine == "libaio"
+        full_sets = self._prepare("constraints-sets.json", "full")
+        for param_set, full_set in zip(param_sets, full_sets):
+            valid = [ c.idx for c in full_set.combinations() ]
+            assert self._covers_valid(valid, 2, param_set.rows)
+
+    """Test if linked params are zipped into one dimension of the product"""
+    def test_links(self):
+        param_sets = self._prepare("linked-sets.json")
+        assert param_sets[0].radices() == [ 2, 3, 2 ]
+        expanded = [ c.to_dicts() for c in multiplex.expand_sets(param_sets) ]
+        assert len(expanded) == 12
+        expected = [ [ mtu, rate, frame, server, client ]
+                     for (mtu, frame), rate, (server, client) in
+                     itertools.product([ ("1518", "64"), ("9216", "9000") ],
+                                       [ "10", "50", "100" ],
+                                       [ ("eth1", "net1"), ("eth2", "net2") ]) ]
+        assert [ [ p["val"] for p in c ] for c in expanded ] == expected
+        for k in range(len(expanded)):
+            assert multiplex.combination_at(param_sets, k).to_dicts() == expanded[k]
+        assert [ c.to_dicts() for c in
+                 multiplex.expand_sets(param_sets, 3, 8) ] == expanded[3:8]
+        report = multiplex.count_sets(param_sets)
+        assert report["output-bytes"] == len(self._dump(param_sets))
+
+    """Test if links are combined with constraints and covering arrays"""
+    def test_links_constraints(self):
+        multiplexer = multiplex.Multiplexer({ "validations": {}, "constraints": [
+            { "exclude": [ { "arg": "frame-size", "gt": 64 },
+                           { "arg": "rate", "vals": [ "100" ] } ] } ] })
+        param_sets = self._prepare("linked-sets.json", multiplexer = multiplexer)
+        expanded = [ [ p["val"] for p in c.to_dicts() ]
+                     for c in multiplex.expand_sets(param_sets) ]
+        assert len(expanded) == 10
+        assert [ "9216", "100", "9000" ] not in [ c[:3] for c in expanded ]
+
+        param_sets = self._prepare("linked-sets.json", "pairwise")
+        expanded = [ [ p["val"] for p in c.to_dicts() ]
+                     for c in multiplex.expand_sets(param_sets) ]
+        assert len(expanded) == 6
+        for c in expanded:
+            assert (c[0], c[2]) in [ ("1518", "64"), ("9216", "9000") ]
+
+    """Test if linking params with different numbers of vals fails"""
+    def test_links_mismatch(self):
+        records = [ multiplex.ParamRecord({ "arg": "a" }, [ "1", "2" ]),
+                    multiplex.ParamRecord({ "arg": "b" }, [ "1" ]) ]
+        with pytest.raises(multiplex.LinksError) as e:
+            multiplex.link_params(records, [ [ { "arg": "a" }, { "arg": "b" } ] ])
+        assert e.value.exit_code == multiplex.EC_LINKS_FAIL
+        records[1] = multiplex.ParamRecord({ "arg": "b" }, [ "1", "2" ])
+        records.append(multiplex.ParamRecord({ "arg": "c" }, [ "1", "2" ]))
+        with pytest.raises(multiplex.LinksError):
+            multiplex.link_params(records, [ [ { "arg": "a" }, { "arg": "b" } ],
+                                             [ { "arg": "b" }, { "arg": "c" } ] ])
+
+    """Test if the reflected gray order changes a single val at a time"""
+    @pytest.mark.parametrize("radices,order", [ ([2, 3, 4], [0, 1, 2]),
+                                                ([3, 1, 2, 3], [3, 0, 2, 1]) ])
+    def test_gray_decode(self, radices, order):
+        count = math.prod(radices)
+        rows = [ multiplex.gray_decode(radices, order, k) for k in range(count) ]
+        assert sorted(rows) == list(itertools.product(*map(range, radices)))
+        for a, b in zip(rows, rows[1:]):
+            assert sum(x != y for x, y in zip(a, b)) == 1
+        for k, idx in enumerate(rows):
+            assert multiplex.gray_rank(radices, order, idx) == k
+
+    """Test if the gray order of a full product lowers the reported cost"""
+    def test_order_gray(self):
+        multiplexer = self._multiplexer("requirements-change-cost.json")
+        param_sets = self._prepare("linked-sets.json", multiplexer = multiplexer)
+        param_set = param_sets[0]
+        costs = multiplex.dim_costs(param_set, multiplexer.change_costs)
+        # mtu and frame-size are linked, changed together
+        assert costs == [ 20, 0, 0 ]
+        product = [ c.idx for c in param_set.combinations() ]
+        before, after = multiplexer.order(param_sets, "gray")[0]
+        ordered = [ c.idx for c in param_set.combinations() ]
+        cost = lambda rows: multiplex.sequence_cost(
+            [ 10, 0, 10, 0, 0 ], rows)
+        assert (before, after) == (cost(product), cost(ordered)) == (20, 20)
+        assert sorted(ordered) == sorted(product)
+        for k in range(len(ordered)):
+            assert param_set.combination(k).idx == ordered[k]
+        assert [ c.idx for c in param_set.combinations(3, 7) ] == ordered[3:7]
+
+        # the expensive param changes the least
+        param_set = multiplex.ParamSet((
+            multiplex.ParamRecord({ "arg": "rw" }, [ "read", "write" ]),
+            multiplex.ParamRecord({ "arg": "mtu" }, [ "1500", "4000", "9000" ])))
+        assert multiplex.order_set(param_set, "gray", { "mtu": 10 }) == (50, 20)
+        assert [ c.idx for c in param_set.combinations() ] == [
+            (0, 0), (1, 0), (1, 1), (0, 1), (0, 2), (1, 2) ]
+
+    """Test if reordering a constrained set keeps its combinations"""
+    @pytest.mark.parametrize("mode", multiplex.ORDERS)
+    def test_order_constrained(self, mode):
+        change_costs = dict(self._multiplexer(
+            "requirements-change-cost.json").change_costs, bs = 3, iodepth = 1)
+        param_set = self._prepare("constraints-sets.json")[0]
+        costs = multiplex.dim_costs(param_set, change_costs)
+        product = [ c.idx for c in param_set.combinations() ]
+        before, after = multiplex.order_set(param_set, mode, change_costs)
+        ordered = [ c.idx for c in param_set.combinations() ]
+        assert sorted(ordered) == sorted(product)
+        assert before == multiplex.sequence_cost(costs, product)
+        assert after == multiplex.sequence_cost(costs, ordered)
+        assert after <= before
+        if mode == "product":
+            assert ordered == product
+
+    """Test if the run cost model is computed for each combination"""
+    def test_combination_costs(self):
+        multiplexer = self._multiplexer("requirements-run-cost.json")
+        param_sets = self._prepare("run-cost-sets.json", multiplexer = multiplexer)
+        costs = multiplexer.costs(param_sets)
+        expected = [ runtime * numjobs / 2 + weight
+                     for weight in [ 10, 30 ] for runtime in [ 30, 120 ]
+                     for numjobs in [ 1, 4 ] ] + [ 10, 10 ]
+        assert list(costs) == expected
+        assert list(multiplex.combination_costs(param_sets, [])) == [ 1 ] * 10
+
+    """Test if the partitions balance the costs (longest first)"""
+    def test_partition_costs(self):
+        costs = [ 2, 7, 3, 3, 5, 2, 4 ]
+        assignment, loads = multiplex.partition_costs(costs, 3)
+        assert list(assignment) == [ 0, 0, 2, 1, 1, 2, 2 ]
+        assert loads == [ 9, 8, 9 ]
+        for p, load in enumerate(loads):
+            assert load == sum(c for c, a in zip(costs, assignment) if a == p)
+        # more partitions than combinations
+        assignment, loads = multiplex.partition_costs([ 1, 1 ], 3)
+        assert list(assignment) == [ 0, 1 ] and loads == [ 1, 1, 0 ]
+        assert multiplex.partition_path("out/params.json", 2) == "out/params-2.json"
+
+    """Test if the partitions are written in a single expansion"""
+    @pytest.mark.parametrize("outputs", [ 256, 2 ])
+    def test_dump_partitions(self, outputs, tmp_path, monkeypatch):
+        param_sets = self._prepare("constraints-sets.json")
+        combinations = [ c.to_dicts() for c in multiplex.expand_sets(param_sets) ]
+        assignment = [ k % 4 for k in range(len(combinations)) ]
+        # the second combination is skipped
+        assignment[1] = 4
+        expansions = []
+        expand_sets = multiplex.expand_sets
+        def counted(*args):
+            expansions.append(args)
+            return expand_sets(*args)
+        monkeypatch.setattr(multiplex, "expand_sets", counted)
+        monkeypatch.setattr(multiplex, "PARTITION_OUTPUTS", outputs)
+        monkeypatch.setattr(multiplex, "args", multiplex.process_options(
+            [ "--output", str(tmp_path / "output.json"), "--partitions", "4",
+              "--ids", str(tmp_path / "output.ids"), "--format", "ndjson" ]),
+            raising=False)
+        multiplex.dump_partitions(param_sets, assignment, 4, "ndjson")
+        assert len(expansions) == (4 + outputs - 1) // outputs
+
+        for p in range(4):
+            expected = [ c for c, a in zip(combinations, assignment) if a == p ]
+            output = tmp_path / ("output-%d.json" % (p + 1))
+            assert [ json.loads(line) for line in
+                     output.read_text().splitlines() ] == expected
+            ids = (tmp_path / ("output-%d.ids" % (p + 1))).read_text().split()
+            assert ids == [ "%016x" % multiplex.combination_hash(c)
+                            for c in expected ]
+        assert sorted(os.listdir(tmp_path)) == sorted(
+            "output-%d.%s" % (p, ext) for p in range(1, 5)
+            for ext in [ "json", "ids" ])
+
+        # a failure midway leaves no partial outputs behind
+        def failing(*args):
+            yield next(expand_sets(*args))
+            raise RuntimeError("expansion failure")
+        monkeypatch.setattr(multiplex, "expand_sets", failing)
+        for p in range(1, 5):
+            (tmp_path / ("output-%d.json" % p)).unlink()
+            (tmp_path / ("output-%d.ids" % p)).unlink()
+        with pytest.raises(multiplex.OutputWriteError):
+            multiplex.dump_partitions(param_sets, assignment, 4, "ndjson")
+        assert os.listdir(tmp_path) == []
+
+    """Test if the canonical hash ignores the params order and defaults"""
+    def test_combination_hash(self):
+        params = [ { "arg": "bs", "role": "client", "val": "4K" },
+                   { "arg": "rw", "val": "read", "id": "1" } ]
+        same = [ { "arg": "rw", "role": "client", "val": "read" },
+                 { "arg": "bs", "val": "4K" } ]
+        key = multiplex.combination_hash(params)
+        assert key == multiplex.combination_hash(same)
+        assert 0 <= key < 2 ** 64
+        for other in [ [ params[0], dict(params[1], role = "server") ],
+                       [ params[0], dict(params[1], id = "2") ],
+                       [ params[0], dict(params[1], val = "write") ],
+                       params[:1] ]:
+            assert multiplex.combination_hash(other) != key
+
+    """Test if the duplicate combinations are dropped and counted per set"""
+    def test_dedup(self):
+        param_sets = self._prepare("duplicate-sets.json")
+        for c in multiplex.expand_sets(param_sets):
+            assert c.content_hash() == multiplex.combination_hash(c.to_dicts())
+        dedup = multiplex.Deduplicator(param_sets)
+        unique = [ c.to_dicts() for c in
+                   filter(dedup.is_new, multiplex.expand_sets(param_sets)) ]
+        assert [ [ p["val"] for p in c ] for c in unique ] == [
+            [ "4K", "read" ], [ "4K", "write" ], [ "randwrite", "4K" ],
+            [ "4K", "read" ] ]
+        assert unique[3][1]["role"] == "server"
+        assert dedup.duplicates == [ 0, 2, 0 ]
+
+        # the combinations before a range are seen, not counted
+        dedup = multiplex.Deduplicator(param_sets)
+        dedup.skip(multiplex.expand_sets(param_sets, 0, 3))
+        assert [ dedup.is_new(c) for c in
+                 multiplex.expand_sets(param_sets, 3, 6) ] == [ True, False, True ]
+        assert dedup.duplicates == [ 0, 1, 0 ]
+
+    """Test if the completed IDs are looked up exactly"""
+    def test_completed_ids(self):
+        completed = multiplex.CompletedIds([ 5, 2 ** 64 - 1, 5, 0 ])
+        assert len(completed) == 4
+        for key in [ 0, 5, 2 ** 64 - 1 ]:
+            assert key in completed
+        for key in [ 1, 4, 6, 2 ** 63 ]:
+            assert key not in completed
+
+    """Test if the completed combinations are loaded from a manifest"""
+    def test_load_completed(self, tmp_path):
+        param_sets = self._prepare("constraints-sets.json")
+        combinations = list(multiplex.expand_sets(param_sets))
+        ids = [ c.content_id() for c in combinations ]
+        assert ids == [ c.content_id() for c in multiplex.expand_sets(
+            self._prepare("constraints-sets.json")) ]
+
+        manifest = tmp_path / "completed.ids"
+        manifest.write_text("# resumed\n%s\n%s done\n%s FAILED\n\n%s running\n"
+                            % tuple(ids[:4]))
+        completed = multiplex.load_completed(str(manifest))
+        pending = list(filter(completed.is_pending, combinations))
+        assert pending == combinations[2:]
+        assert completed.skipped == 2
+
+        # a previous output: all its combinations are completed
+        output = tmp_path / "output.json"
+        output.write_text(multiplex.dump_json(
+            [ c.to_dicts() for c in combinations[5:9] ]))
+        completed = multiplex.load_completed(str(output))
+        assert [ c for c in combinations if not completed.is_pending(c) ] == \
+            combinations[5:9]
+
+        # in any format, columnar with the params of other sets as null
+        for format in multiplex.OUTPUT_FORMATS:
+            output.write_text(self._dump_format(param_sets, format))
+            completed = multiplex.load_completed(str(output))
+            assert len(completed) == len(combinations)
+            assert not any(map(completed.is_pending, combinations))
+
+        for contents in [ "xyz\n", ids[0][:15] + "\n", ids[0] + " done now\n",
+                          "[ 1, 2 ]", '{ "rows": [] }', "[{}]\n[1]\n" ]:
+            manifest.write_text(contents)
+            assert multiplex.load_completed(str(manifest)) is None
+        assert multiplex.load_completed(str(tmp_path / "missing")) is None
+
+    """Test if the IDs are written in the output order"""
+    def test_write_ids(self, tmp_path):
+        param_sets = self._prepare("multi-params-sets.json")
+        ids_file = tmp_path / "output.ids"
+        combinations = list(multiplex.write_ids(
+            multiplex.expand_sets(param_sets), str(ids_file)))
+        assert ids_file.read_text().splitlines() == [
+            c.content_id() for c in combinations ]
+        assert not (tmp_path / "output.ids.tmp").exists()
+
+    """Test if sets expanded by several processes are dumped as serially"""
+    @pytest.mark.parametrize("order", [ "product", "gray" ])
+    @pytest.mark.parametrize("format", multiplex.OUTPUT_FORMATS)
+    def test_expand_parallel(self, order, format, monkeypatch):
+        multiplexer = multiplex.Multiplexer()
+        for filename in [ "constraints-sets.json", "linked-sets.json" ]:
+            input_json = multiplex.load_json_file("tests/JSON/" + filename)
+            param_sets = multiplexer.prepare(input_json)
+            multiplexer.order(param_sets, order)
+            total = sum(param_set.count() for param_set in param_sets)
+            framing = multiplex.output_framing(param_sets, format)
+            expected = io.StringIO()
+            multiplex.dump_json_chunks(multiplex.output_elements(
+                param_sets, multiplex.expand_sets(param_sets, 1, total - 1),
+                format), expected, framing)
+
+            monkeypatch.setattr(multiplex, "PARALLEL_CHUNK", 3)
+            chunks = multiplex.expand_parallel(param_sets, format, 1,
+                                               total - 1, 2)
+            stream = io.StringIO()
+            multiplex.dump_json_chunks(chunks, stream, framing)
+            assert stream.getvalue() == expected.getvalue()
+
+        stream = io.StringIO()
+        multiplex.dump_json_chunks(iter([]), stream)
+        assert stream.getvalue() == "[]"
+
+    """Test if the constrained sets are walked once for their parallel tasks"""
+    def test_parallel_tasks(self, monkeypatch):
+        param_sets = self._prepare("constraints-sets.json")
+        assert all(param_set.checks is not None for param_set in param_sets)
+        total = sum(param_set.count() for param_set in param_sets)
+        walks = []
+        iter_constrained = multiplex.iter_constrained
+        def counted(*args):
+            walks.append(args)
+            return iter_constrained(*args)
+        monkeypatch.setattr(multiplex, "iter_constrained", counted)
+        monkeypatch.setattr(multiplex, "PARALLEL_CHUNK", 3)
+        tasks = list(multiplex.parallel_tasks(param_sets, 1, total))
+        assert len(walks) == len(param_sets)
+        assert all(function == multiplex.expand_rows for function, _ in tasks)
+        rows = [ idx for _, (set_idx, chunk) in tasks for idx in chunk ]
+        assert rows == [ c.idx for c in multiplex.expand_sets(param_sets, 1) ]
+        assert all(len(chunk) <= 3 for _, (_, chunk) in tasks)
+
+        # the other sets in ranges of combinations, within a set
+        param_sets = self._prepare("multi-params-sets.json")
+        assert list(multiplex.parallel_tasks(param_sets, 1, 6)) == [
+            (multiplex.expand_chunk, (1, 2)), (multiplex.expand_chunk, (2, 5)),
+            (multiplex.expand_chunk, (5, 6)) ]
+
+    """Test if every output format holds the same combinations"""
+    @pytest.mark.parametrize("format", multiplex.OUTPUT_FORMATS)
+    def test_output_formats(self, format):
+        param_sets = self._prepare("multi-params-sets.json")
+        combinations = list(multiplex.expand_sets(param_sets))
+        expected = list(multiplex.convert_vals(combinations))
+        stream = io.StringIO()
+        multiplex.dump_json_chunks(multiplex.output_elements(
+            param_sets, combinations, format), stream,
+            multiplex.output_framing(param_sets, format))
+        output = stream.getvalue()
+
+        if format == "ndjson":
+            assert output.endswith("\n")
+            assert [ json.loads(line) for line in output.splitlines() ] == expected
+        elif format == "columnar":
+            columnar = json.loads(output)
+            assert [ column["arg"] for column in columnar["columns"] ] == \
+                [ "rw", "ioengine", "bs" ]
+            # a null val for the params not in a set
+            assert [ [ dict(column, val=val) for column, val in
+                       zip(columnar["columns"], row) if val is not None ]
+                     for row in columnar["rows"] ] == expected
+            assert [ row.count(None) for row in columnar["rows"] ] == [ 1 ] * 6
+        else:
+            assert json.loads(output) == expected
+            assert ("\n" in output) == (format == "readable")
+
+        # no combinations
+        stream = io.StringIO()
+        multiplex.dump_json_chunks(iter([]), stream,
+                                   multiplex.output_framing(param_sets, format))
+        if format == "ndjson":
+            assert stream.getvalue() == ""
+        else:
+            empty = json.loads(stream.getvalue())
+            assert empty == [] or empty["rows"] == []
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import pytest
+import os
+import sys
+import json
+import subprocess
+import multiplex
+
+class TestIndex:
+
+    input_json = "tests/JSON/multi-params-sets.json"
+
+    # helper function to run the command line in a new process
+    def _run(self, argv):
+        return subprocess.run([ sys.executable, "multiplex.py", "--input",
+                                self.input_json ] + argv, capture_output=True)
+
+    """Test if any combination of an indexed output is read as in the json output"""
+    @pytest.mark.parametrize("format", multiplex.OUTPUT_FORMATS)
+    def test_indexed_output(self, format, tmp_path):
+        expected = json.loads(self._run([]).stdout)
+        output = tmp_path / "output.json"
+        assert self._run([ "--format", format, "--index", "--output",
+                           str(output) ]).returncode == multiplex.EC_SUCCESS
+        with multiplex.IndexedOutput(str(output)) as indexed:
+            assert len(indexed) == len(expected)
+            assert [ indexed[k] for k in reversed(range(len(indexed))) ] == \
+                expected[::-1]
+            assert indexed[-1] == expected[-1]
+            with pytest.raises(IndexError):
+                indexed[len(expected)]
+
+        # an index per partition, and no combinations
+        assert self._run([ "--format", format, "--index", "--partitions", "2",
+                           "--output", str(output) ]).returncode == \
+            multiplex.EC_SUCCESS
+        combinations = []
+        for p in [ 1, 2 ]:
+            with multiplex.IndexedOutput(str(tmp_path / ("output-%d.json" % p))) \
+                    as indexed:
+                combinations.extend(indexed[k] for k in range(len(indexed)))
+        assert sorted(map(json.dumps, combinations)) == \
+            sorted(map(json.dumps, expected))
+        assert self._run([ "--format", format, "--index", "--range", "2:2",
+                           "--output", str(output) ]).returncode == \
+            multiplex.EC_SUCCESS
+        with multiplex.IndexedOutput(str(output)) as indexed:
+            assert len(indexed) == 0
+
+    """Test if an index that does not match its output is rejected"""
+    def test_invalid_index(self, tmp_path):
+        output = tmp_path / "output.json"
+        with pytest.raises(multiplex.OutputIndexError):
+            multiplex.IndexedOutput(str(output))
+        assert self._run([ "--index", "--output", str(output) ]).returncode == \
+            multiplex.EC_SUCCESS
+        index = tmp_path / "output.json.idx"
+        assert not (tmp_path / "output.json.tmp").exists()
+        assert not (tmp_path / "output.json.idx.tmp").exists()
+
+        contents = output.read_bytes()
+        output.write_bytes(contents + b"\n")
+        with pytest.raises(multiplex.OutputIndexError):
+            multiplex.IndexedOutput(str(output))
+        output.write_bytes(contents)
+        index.write_bytes(index.read_bytes()[:-1])
+        with pytest.raises(multiplex.OutputIndexError):
+            multiplex.IndexedOutput(str(output))
+
+        # no output file to index
+        assert self._run([ "--index" ]).returncode == 2
+        assert self._run([ "--index", "--gzip", "--output",
+                           str(output) ]).returncode == 2
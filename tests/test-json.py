@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import pytest
+import io
 import json
 import multiplex
 import re
@@ -57,9 +58,13 @@ class TestJSON:
                              [ "enabled-sets-expected.json" ], indirect=True)
     def test_multiplex_sets(self, load_json_file):
         multiplexed_json = multiplex.multiplex_sets(load_json_file)
-        processed_json = json.dumps(multiplexed_json, sort_keys=True, indent=4,
+        processed_json = json.dumps(list(multiplex.convert_vals(multiplexed_json)),
+                                    sort_keys=True, indent=4,
                                     separators=(',',': '))
-        expected_json = self._load_json("single-value-sets-expected.json")
+        single_json = multiplex.load_json_file("tests/JSON/single-value-sets-expected.json")
+        expected_json = json.dumps(list(multiplex.convert_vals(single_json)),
+                                   sort_keys=True, indent=4,
+                                   separators=(',',': '))
 
         assert processed_json == expected_json
 
@@ -68,7 +73,7 @@ class TestJSON:
                              [ "single-value-sets-expected.json" ],
                              indirect=True)
     def test_convert_vals_into_val(self, load_json_file):
-        final_json = multiplex.convert_vals(load_json_file)
+        final_json = list(multiplex.convert_vals(load_json_file))
         processed_json = json.dumps(final_json, sort_keys=True, indent=4,
                                     separators=(',',': '))
         expected_json = self._load_json("final-expected.json")
@@ -102,9 +107,13 @@ class TestJSON:
                              indirect=True)
     def test_multiplex_multi_sets(self, load_json_file):
         multiplexed_json = multiplex.multiplex_sets(load_json_file)
-        processed_json = json.dumps(multiplexed_json, sort_keys=True, indent=4,
+        processed_json = json.dumps(list(multiplex.convert_vals(multiplexed_json)),
+                                    sort_keys=True, indent=4,
                                     separators=(',',': '))
-        expected_json = self._load_json("multiplexed-expected.json")
+        single_json = multiplex.load_json_file("tests/JSON/multiplexed-expected.json")
+        expected_json = json.dumps(list(multiplex.convert_vals(single_json)),
+                                   sort_keys=True, indent=4,
+                                   separators=(',',': '))
 
         assert processed_json == expected_json
 
@@ -112,7 +121,7 @@ class TestJSON:
     @pytest.mark.parametrize("load_json_file", [ "multiplexed-expected.json" ],
                              indirect=True)
     def test_convert_vals(self, load_json_file):
-        finalized_json = multiplex.convert_vals(load_json_file)
+        finalized_json = list(multiplex.convert_vals(load_json_file))
         for sets in finalized_json:
             for set in sets:
                 assert 'vals' not in set
@@ -124,7 +133,7 @@ class TestJSON:
     def test_dup_param_diff_role(self, load_json_file):
         combined_json = multiplex.load_param_sets(load_json_file)
         multiplexed_json = multiplex.multiplex_sets(combined_json)
-        finalized_json = multiplex.convert_vals(multiplexed_json)
+        finalized_json = list(multiplex.convert_vals(multiplexed_json))
         processed_json = json.dumps(finalized_json, sort_keys=True, indent=4,
                                     separators=(',',': '))
         expected_json = self._load_json("expected-dup-param-diff-role.json")
@@ -185,3 +194,73 @@ class TestJSON:
         expected_json = self._load_json("multi-sets-expected.json")
 
         assert processed_json == expected_json
+
+    """Test if multiplex_sets expands sets lazily"""
+    @pytest.mark.parametrize("load_json_file", [ "multi-sets-expected.json" ],
+                             indirect=True)
+    def test_multiplex_sets_lazy(self, load_json_file):
+        multiplexed_json = multiplex.multiplex_sets(load_json_file)
+        assert not isinstance(multiplexed_json, list)
+        first = next(multiplexed_json)
+        assert isinstance(first, multiplex.Combination)
+        assert first.idx == (0, 0)
+
+    """Test if combinations share the param records of their set"""
+    @pytest.mark.parametrize("load_json_file", [ "multi-sets-expected.json" ],
+                             indirect=True)
+    def test_combinations_share_records(self, load_json_file):
+        combinations = list(multiplex.multiplex_sets(load_json_file))
+        assert len(combinations) == 6
+        assert combinations[0].records is combinations[1].records
+        assert combinations[1].to_dicts()[0] == { "arg": "rw", "role": "client",
+                                                  "val": "write" }
+
+    """Test if the streamed json is identical to the one-shot dump"""
+    @pytest.mark.parametrize("format", [ "readable", "parseable" ])
+    @pytest.mark.parametrize("load_json_file", [ "multiplexed-expected.json" ],
+                             indirect=True)
+    def test_dump_json_stream(self, load_json_file, format):
+        final_json = list(multiplex.convert_vals(load_json_file))
+        stream = io.StringIO()
+        multiplex.dump_json_stream(iter(final_json), stream, format)
+        assert stream.getvalue() == multiplex.dump_json(final_json, format)
+
+    """Test if an empty stream is dumped as an empty array"""
+    @pytest.mark.parametrize("format", [ "readable", "parseable" ])
+    def test_dump_json_stream_empty(self, format):
+        stream = io.StringIO()
+        multiplex.dump_json_stream(iter([]), stream, format)
+        assert stream.getvalue() == multiplex.dump_json([], format)
+
+    """Test if params are keyed by arg, role and id with their defaults"""
+    def test_param_key(self):
+        assert multiplex.param_key({ "arg": "bs" }) == ("bs", "client", "1")
+        assert (multiplex.param_key({ "arg": "bs", "role": "server", "id": "2" })
+                == ("bs", "server", "2"))
+
+    """Test if set params override included ones in place"""
+    def test_override_keeps_position(self):
+        sets_block = {
+            "global-options": [ { "name": "common", "params": [
+                { "arg": "rw", "vals": [ "read" ] },
+                { "arg": "bs", "vals": [ "4k" ], "role": "client", "id": "1" },
+                { "arg": "bs", "vals": [ "8k" ], "role": "server" } ] } ],
+            "sets": [ { "include": "common", "params": [
+                { "arg": "bs", "vals": [ "16k" ] },
+                { "arg": "ioengine", "vals": [ "sync" ] } ] } ]
+        }
+        combined_json = multiplex.load_param_sets(sets_block)
+        assert [ (p["arg"], p["vals"][0]) for p in combined_json[0] ] == [
+            ("rw", "read"), ("bs", "16k"), ("bs", "8k"), ("ioengine", "sync") ]
+
+    """Test if included params are resolved once and shared by the sets"""
+    @pytest.mark.parametrize("load_json_file", [ "multi-params-sets.json" ],
+                             indirect=True)
+    def test_include_shared(self, load_json_file):
+        combined_json = multiplex.load_param_sets(load_json_file)
+        assert combined_json[0][0] is combined_json[1][0]
+
+        # sanitizing a set never changes the shared params
+        sanitized = multiplex.sanitize_set(combined_json[0])
+        assert sanitized[0]["role"] == "client"
+        assert "role" not in combined_json[1][0]
@@ -2,6 +2,7 @@
 
 import pytest
 import json
+import os
 import re
 import multiplex
 
@@ -70,11 +71,13 @@ class TestRequirements:
         param = next((item for item in multiplex.presets_dict["sequential-read"] if item["arg"] == "bs"), False)
         assert param["vals"] == ["4K"]
 
-    """Test if validation regex w/ single escape fails"""
+    """Test if validation regex w/ single escape fails to load"""
     @pytest.mark.parametrize("load_req", [ req_single_escape ], indirect=True)
-    @pytest.mark.xfail(reason="single escape raises an exception")
     def test_create_validation_dict(self, load_req):
-        assert multiplex.load_json_file(load_req) is None
+        # '\.' is an invalid escape in json strings
+        assert load_req is None
+        with pytest.raises(json.JSONDecodeError, match="Invalid \\\\escape"):
+            json.loads(self._load_json(self.req_single_escape))
 
     """Test if validation dict has empty presets (which is ok)"""
     @pytest.mark.parametrize("load_req", [ req_presets_empty ], indirect=True)
@@ -230,3 +233,175 @@ class TestRequirements:
         multiplex.transform_dict = { "size": { "search": "K", "replace": "kiB" } }
         transformed = multiplex.transform_param_val("size", "1024-2048")
         assert transformed == "1kiB-2kiB"
+
+    """Test anchored literal patterns take the set lookup fast path"""
+    def test_matcher_literals(self):
+        matcher = multiplex.ValMatcher(("^fio$", "^sync$|^libaio$"))
+        assert matcher.literals == { "fio", "sync", "libaio" }
+        assert matcher.regexes == []
+        assert matcher.match("libaio") is True
+        assert matcher.match("fio2") is False
+
+    """Test regex patterns of a param are merged into one matcher"""
+    def test_matcher_merged(self):
+        matcher = multiplex.ValMatcher(("^[1-9]+[0-9]*$", "^[A-Z]*$", "^fio$"))
+        assert len(matcher.regexes) == 1
+        assert matcher.match("60") is True
+        assert matcher.match("ABC") is True
+        assert matcher.match("fio") is True
+        assert matcher.match("0023") is False
+
+    """Test patterns with backreferences are not merged"""
+    def test_matcher_backref(self):
+        matcher = multiplex.ValMatcher(("^(a)\\1$", "^b$", "^c+$"))
+        assert len(matcher.regexes) == 2
+        assert matcher.match("aa") is True
+        assert matcher.match("ccc") is True
+
+    """Test transformed vals are memoized per requirements"""
+    def test_transform_memo(self):
+        multiplex.validation_dict = { "bs": "^[1-9][0-9]*[BKMG]?$" }
+        multiplex.convert_dict = {}
+        multiplex.transform_dict = { "bs": { "search": "K$", "replace": "KiB" } }
+        transformer = multiplex.param_transformer()
+        assert multiplex.transform_param_val("bs", "4K") == "4KiB"
+        assert multiplex.transform_param_val("bs", "4K") == "4KiB"
+        assert transformer.transform.cache_info().hits == 1
+
+        # new requirements dicts are compiled again
+        multiplex.transform_dict = { "bs": { "search": "K$", "replace": "kB" } }
+        assert multiplex.param_transformer() is not transformer
+        assert multiplex.transform_param_val("bs", "4K") == "4kB"
+        multiplex.validation_dict = {}
+        multiplex.transform_dict = {}
+
+    """Test units expressions are parsed into exact factors"""
+    @pytest.mark.parametrize("expr,factor", [ ("1", 1), ("1024*1024", 1048576),
+                                              ("1/1024/1024", multiplex.Fraction(1, 1048576)),
+                                              ("0.5 * 2", 1), ("1024*", None),
+                                              ("__import__('os')", None), ("1/0", None) ])
+    def test_parse_factor(self, expr, factor):
+        assert multiplex.parse_factor(expr) == factor
+
+    """Test invalid units expressions are never evaluated"""
+    def test_convert_invalid_expression(self, caplog):
+        converter = multiplex.UnitConverter("", { "": "1", "K": "exit(1)" })
+        assert "K" not in converter.factors
+        assert "Invalid conversion expression 'exit(1)'" in caplog.text
+        assert converter.convert("4K") == "4K"
+
+    """Test (single) val convert K-to-K with decimals"""
+    def test_convert_decimal(self):
+        converter = multiplex.UnitConverter("K", { "K": "1", "M": "1024", "": "1/1024" })
+        assert converter.convert("0.1M") == "102.4K"
+        assert converter.convert("1.5M") == "1536K"
+        assert converter.convert("100") == "0.09765625K"
+
+    """Test big vals lists are converted in one pass, with the same result"""
+    def test_transform_vals_batch(self):
+        multiplex.validation_dict = { "size": "^[1-9][0-9]*[KM]?$" }
+        multiplex.convert_dict = { "size": { "K": { "": "1/1024", "K": "1", "M": "1024" } } }
+        multiplex.transform_dict = { "size": { "search": "K", "replace": "kiB" } }
+        vals = [ "%d%s" % (n, u) for n in range(1, 100) for u in ("", "K", "M") ]
+        transformer = multiplex.param_transformer()
+        batch = transformer.transform_vals("size", vals)
+        assert len(vals) >= multiplex.BATCH_TRANSFORM_MIN
+        assert batch == [ multiplex.transform_param_val("size", v) for v in vals ]
+        assert batch[:3] == [ "0.0009765625kiB", "1kiB", "1024kiB" ]
+        multiplex.validation_dict = {}
+        multiplex.convert_dict = {}
+        multiplex.transform_dict = {}
+
+    """Test essentials override params of every set, not only the first one"""
+    def test_override_essentials_all_sets(self):
+        multiplex.presets_dict = {}
+        json_req = multiplex.load_json_file("tests/JSON/requirements-pass.json")
+        multiplex.load_presets(json_req)
+        essentials = json.dumps(multiplex.presets_dict["essentials"])
+        json_obj = [ [ { "arg": "bs", "vals": [ "4K", "8K" ] } ],
+                     [ { "arg": "bs", "vals": [ "16K" ] },
+                       { "arg": "bs", "vals": [ "32K" ], "role": "server" } ] ]
+        overriden = multiplex.override_presets(json_obj)
+        assert [ [ (p["arg"], p["vals"][0], p.get("role")) for p in s ]
+                 for s in overriden ] == [
+            [ ("bs", "1K", None), ("duration", "60", None) ],
+            [ ("bs", "1K", None), ("bs", "32K", "server"), ("duration", "60", None) ] ]
+        # the presets are left untouched
+        assert json.dumps(multiplex.presets_dict["essentials"]) == essentials
+
+    """Test if compiled requirements are cached on disk, by contents"""
+    def test_requirements_cache(self, tmp_path, monkeypatch):
+        req_file = tmp_path / "requirements.json"
+        with open("tests/JSON/" + self.requirements_json) as req_fp:
+            req_file.write_text(req_fp.read())
+        cache = tmp_path / "cache"
+        multiplex._multiplexers.clear()
+        compiled = multiplex.load_multiplexer(str(req_file), None, str(cache))
+        entries = list(cache.iterdir())
+        assert len(entries) == 1
+
+        # cached: the requirements are not validated again
+        multiplex._multiplexers.clear()
+        monkeypatch.setattr(multiplex, "validate_schema", None)
+        cached = multiplex.load_multiplexer(str(req_file), None, str(cache))
+        assert cached is not compiled
+        assert json.dumps(cached.compiled()) == json.dumps(compiled.compiled())
+        input_json = multiplex.load_json_file("tests/JSON/multi-params-sets.json")
+        monkeypatch.undo()
+        assert list(cached.expand(input_json)) == list(compiled.expand(input_json))
+
+        # changed contents: a new entry, corrupted entry: compiled again
+        req_file.write_text(req_file.read_text().replace("60", "30"))
+        multiplex._multiplexers.clear()
+        multiplex.load_multiplexer(str(req_file), None, str(cache))
+        assert len(list(cache.iterdir())) == 2
+        entries[0].write_text("{ corrupted")
+        multiplex._multiplexers.clear()
+        req_file.write_text(req_file.read_text().replace("30", "60"))
+        reloaded = multiplex.load_multiplexer(str(req_file), None, str(cache))
+        assert json.dumps(reloaded.compiled()) == json.dumps(compiled.compiled())
+        assert json.loads(entries[0].read_text())["presets"] == compiled.presets
+
+        # an entry missing fields: compiled again
+        entries[0].write_text(json.dumps({ "key": json.loads(
+            entries[0].read_text())["key"] }))
+        multiplex._multiplexers.clear()
+        reloaded = multiplex.load_multiplexer(str(req_file), None, str(cache))
+        assert json.dumps(reloaded.compiled()) == json.dumps(compiled.compiled())
+        assert json.loads(entries[0].read_text())["presets"] == compiled.presets
+
+        # invalid requirements are never cached
+        req_file.write_text('{ "validations": [] }')
+        multiplex._multiplexers.clear()
+        with pytest.raises(multiplex.RequirementsSchemaError):
+            multiplex.load_multiplexer(str(req_file), None, str(cache))
+        assert len(list(cache.iterdir())) == 2
+        multiplex._multiplexers.clear()
+
+    """Test if the least recently used and old cache entries are evicted"""
+    def test_cache_eviction(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(multiplex, "CACHE_MAX_ENTRIES", 3)
+        cache = tmp_path / "cache"
+        cache.mkdir()
+        now = multiplex.time.time()
+        for n in range(5):
+            entry = cache / ("input-%d" % n)
+            entry.write_text("")
+            os.utime(entry, (now - n * 60, now - n * 60))
+        (cache / "other").write_text("")
+        os.utime(cache / "input-1", (now - multiplex.CACHE_MAX_AGE - 1,) * 2)
+        multiplex.prune_cache(str(cache))
+        assert sorted(path.name for path in cache.iterdir()) == \
+            [ "input-0", "input-2", "input-3", "other" ]
+
+        # used entries are kept, the least recently used one evicted
+        input_file = tmp_path / "input.json"
+        input_file.write_text("{}")
+        marker, trusted = multiplex.validated_input(str(input_file), str(cache))
+        multiplex.mark_validated(marker)
+        assert not (cache / "input-3").exists()
+        os.utime(cache / "input-0", (now - 3600,) * 2)
+        assert multiplex.validated_input(str(input_file), str(cache))[1]
+        multiplex.mark_validated(str(cache / "input-5"))
+        assert sorted(path.name for path in cache.iterdir()) == \
+            sorted([ "input-2", "input-5", os.path.basename(marker), "other" ])
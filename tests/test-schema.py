@@ -40,3 +40,46 @@ class TestSchema:
     def test_params_ids_invalid(self, load_json_file):
         rt = multiplex.validate_schema(load_json_file, "schema.json")
         assert rt is True
+
+    """Test if schemas are loaded and compiled once per process"""
+    @pytest.mark.parametrize("load_json_file", [ "validate-schema-good.json" ], indirect=True)
+    def test_schema_validator_cached(self, load_json_file):
+        validator = multiplex.schema_validator("schema.json")
+        assert multiplex.validate_schema(load_json_file, "schema.json") == True
+        assert multiplex.schema_validator("schema.json") is validator
+
+    """Test if duplicated sets are still rejected (uniqueItems)"""
+    @pytest.mark.parametrize("load_json_file", [ "validate-schema-good.json" ], indirect=True)
+    def test_validate_schema_duplicated_sets(self, load_json_file):
+        load_json_file["sets"].append(json.loads(json.dumps(load_json_file["sets"][0])))
+        rt = multiplex.validate_schema(load_json_file, "schema.json")
+        assert rt == False
+
+    """Test if JSON equality is used for uniqueItems"""
+    def test_unique_key(self):
+        assert multiplex.unique_key({ "a": [1, "x"], "b": True }) == \
+               multiplex.unique_key({ "b": True, "a": [1.0, "x"] })
+        assert multiplex.unique_key(True) != multiplex.unique_key(1)
+        assert multiplex.unique_key("1") != multiplex.unique_key(1)
+
+    """Test if the compiled schemas agree with jsonschema on all the test files"""
+    @pytest.mark.parametrize("schema_file", [ "schema.json", "req-schema.json" ])
+    def test_compiled_schema_parity(self, schema_file):
+        validator = multiplex.schema_validator(schema_file)
+        assert validator.check is not None
+        for json_file in sorted(os.listdir("tests/JSON")):
+            json_obj = multiplex.load_json_file("tests/JSON/" + json_file)
+            if json_obj is None:
+                continue
+            assert (validator.check(json_obj) ==
+                    validator.validator.is_valid(json_obj)), json_file
+
+    """Test if schemas with unsupported keywords are not compiled"""
+    def test_compile_schema_unsupported(self):
+        with pytest.raises(multiplex.UncompiledSchemaError):
+            multiplex.compile_schema({ "type": "array", "maxItems": 2 })
+        check = multiplex.compile_schema({ "type": "array", "minItems": 2,
+                                           "items": { "enum": [ "a", "b", 1 ] } })
+        assert check([ "a", 1.0 ]) is True
+        assert check([ "a", True ]) is False
+        assert check([ "a" ]) is False
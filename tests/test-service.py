@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+import pytest
+import io
+import os
+import sys
+import subprocess
+import socket
+import threading
+import multiplex
+import multiplex_client
+
+class TestService:
+
+    input_json = "tests/JSON/multi-params-sets.json"
+    requirements_json = "tests/JSON/requirements-pass.json"
+
+    """Common function to run a service in a thread"""
+    @pytest.fixture(scope="function")
+    def service(self, tmp_path):
+        socket_path = str(tmp_path / "multiplex.sock")
+        service = multiplex.make_service(socket_path)
+        thread = threading.Thread(target=service.serve_forever)
+        thread.start()
+        yield socket_path
+        service.shutdown()
+        service.server_close()
+        thread.join()
+
+    # helper function to run the command line in a new process
+    def _run(self, argv, env = None):
+        return subprocess.run([ sys.executable, "multiplex.py" ] + argv,
+                              capture_output=True, env=env)
+
+    # helper function to run the command line on a service
+    def _call(self, socket_path, argv):
+        stdout = io.BytesIO()
+        stderr = io.BytesIO()
+        code = multiplex.call_service(socket_path, argv, stdout, stderr)
+        return code, stdout.getvalue(), stderr.getvalue()
+
+    """Test if the service answers as the command line"""
+    @pytest.mark.parametrize("argv", [
+        [ "--input", input_json ],
+        [ "--input", input_json, "--requirements", requirements_json ],
+        [ "--input", input_json, "--requirements", requirements_json,
+          "--dry-run" ],
+        [ "--input", "tests/JSON/params-ids-invalid.json" ],
+        [ "--input", "missing.json" ],
+        [ "--input", input_json, "--shard", "3/2" ],
+    ])
+    def test_same_output(self, service, argv):
+        expected = self._run(argv)
+        code, stdout, stderr = self._call(service, argv)
+        assert code == expected.returncode
+        assert stdout == expected.stdout
+        assert bool(stderr) == bool(expected.stderr)
+
+    """Test if the requirements are compiled once per contents"""
+    def test_requirements_cache(self, service, tmp_path):
+        multiplex._multiplexers.clear()
+        argv = [ "--input", self.input_json, "--requirements",
+                 self.requirements_json, "--count" ]
+        assert self._call(service, argv)[0] == multiplex.EC_SUCCESS
+        multiplexer = multiplex._multiplexers[next(iter(multiplex._multiplexers))]
+        assert self._call(service, argv)[0] == multiplex.EC_SUCCESS
+        assert list(multiplex._multiplexers.values()) == [ multiplexer ]
+
+        # the same contents in another file: cached, changed contents: not
+        copy_json = tmp_path / "requirements.json"
+        with open(self.requirements_json) as req_fp:
+            copy_json.write_text(req_fp.read())
+        argv[3] = str(copy_json)
+        assert self._call(service, argv)[0] == multiplex.EC_SUCCESS
+        assert len(multiplex._multiplexers) == 1
+        copy_json.write_text(copy_json.read_text().replace("60", "30"))
+        assert self._call(service, argv)[0] == multiplex.EC_SUCCESS
+        assert len(multiplex._multiplexers) == 2
+
+        for n in range(multiplex.MULTIPLEXER_CACHE_SIZE + 1):
+            multiplex.load_multiplexer(None, n + 1)
+        assert len(multiplex._multiplexers) == multiplex.MULTIPLEXER_CACHE_SIZE
+        assert multiplexer not in multiplex._multiplexers.values()
+        multiplex._multiplexers.clear()
+
+    """Test if the command line uses the service, and runs without it"""
+    def test_client(self, service, tmp_path):
+        argv = [ "--input", self.input_json ]
+        expected = self._run(argv)
+        env = dict(os.environ, MULTIPLEX_SOCKET=service)
+        assert self._run(argv, env).stdout == expected.stdout
+
+        # relative paths are relative to the client directory
+        result = subprocess.run([ sys.executable, os.path.abspath("multiplex.py"),
+                                  "--input", os.path.abspath(self.input_json),
+                                  "--output", "output.json" ],
+                                cwd=tmp_path, env=env)
+        assert result.returncode == multiplex.EC_SUCCESS
+        assert (tmp_path / "output.json").read_bytes() + b"\n" == expected.stdout
+
+        # no service on the socket: run in the process
+        env[multiplex.SERVICE_ENV] = str(tmp_path / "stopped.sock")
+        assert multiplex.call_service(env[multiplex.SERVICE_ENV], argv) is None
+        assert self._run(argv, env).stdout == expected.stdout
+
+    """Test if the command lines starting a service are not forwarded"""
+    def test_starts_service(self, service):
+        for argv in [ [ "--serve", "x.sock" ], [ "--serve=x.sock" ],
+                      [ "--input", self.input_json, "--ser", "x.sock" ],
+                      [ "--se=x.sock" ] ]:
+            assert multiplex_client.starts_service(argv)
+            assert multiplex.process_options(argv).serve == "x.sock"
+        for argv in [ [ "--input", self.input_json ], [ "--shard", "1/2" ],
+                      [ "--input", "--", "--serve" ] ]:
+            assert not multiplex_client.starts_service(argv)
+        # --s is ambiguous (--shard, --strategy)
+        with pytest.raises(SystemExit):
+            multiplex.process_options([ "--s", "x.sock" ])
+
+        # forwarded anyway, the service does not start another one
+        code, stdout, stderr = self._call(service, [ "--serve=x.sock" ])
+        assert code == multiplex.EC_SERVICE_FAIL
+        assert b"does not start services" in stderr
+
+    """Test if a connection closed by the service is a service failure"""
+    def test_closed_connection(self, tmp_path):
+        socket_path = str(tmp_path / "closing.sock")
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+        server.listen()
+        def close():
+            connection, _ = server.accept()
+            connection.recv(4096)
+            connection.close()
+        thread = threading.Thread(target=close)
+        thread.start()
+        code, stdout, stderr = self._call(socket_path,
+                                          [ "--input", self.input_json ])
+        thread.join()
+        server.close()
+        assert code == multiplex.EC_SERVICE_FAIL
+        assert b"closed the connection" in stderr
+
+    """Test if the service only replaces the socket of a stopped service"""
+    def test_make_service(self, service, tmp_path):
+        with pytest.raises(multiplex.ServiceError) as e:
+            multiplex.make_service(service)
+        assert e.value.exit_code == multiplex.EC_SERVICE_FAIL
+        assert self._call(service, [ "--input", self.input_json ])[0] == \
+            multiplex.EC_SUCCESS
+
+        other = tmp_path / "other.json"
+        other.write_text("{}")
+        with pytest.raises(multiplex.ServiceError):
+            multiplex.make_service(str(other))
+        assert other.read_text() == "{}"
+
+        # left behind by a stopped service
+        stale = str(tmp_path / "stale.sock")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(stale)
+        sock.close()
+        stopped = multiplex.make_service(stale)
+        stopped.server_close()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+import pytest
+import os
+import sys
+import time
+import statistics
+import subprocess
+import multiplex
+
+# wall time of a trivial run over the interpreter startup (seconds)
+STARTUP_BUDGET = 0.3
+
+class TestStartup:
+
+    input_json = "JSON/mv-params-input.json"
+
+    # helper function to run the command line in a new process
+    def _run(self, argv, env = None):
+        return subprocess.run([ sys.executable ] + argv, capture_output=True,
+                              env=env)
+
+    # helper function to time the median of several runs
+    def _time(self, argv, runs = 5):
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            assert self._run(argv).returncode == 0
+            times.append(time.perf_counter() - start)
+        return statistics.median(times)
+
+    """Test if jsonschema is only imported to report validation errors"""
+    def test_lazy_jsonschema(self, tmp_path):
+        env = dict(os.environ, MULTIPLEX_CACHE_DIR=str(tmp_path))
+        result = self._run([ "-X", "importtime", "multiplex.py", "--input",
+                             self.input_json, "--requirements",
+                             "tests/JSON/requirements-pass.json" ], env)
+        assert result.returncode == multiplex.EC_SUCCESS
+        assert b"jsonschema" not in result.stderr
+
+        result = self._run([ "-X", "importtime", "multiplex.py", "--input",
+                             "tests/JSON/params-ids-invalid.json" ], env)
+        assert result.returncode == multiplex.EC_SCHEMA_FAIL
+        assert b"jsonschema" in result.stderr
+
+    """Test if the cold start of a trivial run stays within budget"""
+    def test_startup_time(self):
+        interpreter = self._time([ "-c", "pass" ])
+        startup = self._time([ "multiplex.py", "--input", self.input_json ])
+        assert startup - interpreter < STARTUP_BUDGET
+
+    """Test if trusted inputs are only validated once per contents"""
+    def test_trusted(self, tmp_path):
+        input_file = tmp_path / "input.json"
+        with open(self.input_json) as input_fp:
+            input_file.write_text(input_fp.read())
+        marker, trusted = multiplex.validated_input(str(input_file), str(tmp_path))
+        assert not trusted
+        env = dict(os.environ, MULTIPLEX_CACHE_DIR=str(tmp_path))
+        argv = [ "multiplex.py", "--input", str(input_file), "--trusted" ]
+        expected = self._run(argv[:3], env)
+        assert self._run(argv, env).stdout == expected.stdout
+        assert multiplex.validated_input(str(input_file), str(tmp_path)) == \
+            (marker, True)
+        result = self._run(argv + [ "--debug" ], env)
+        assert result.stdout == expected.stdout
+        assert b"skipping its validation" in result.stderr
+
+        # changed contents are validated again
+        input_file.write_text(input_file.read_text().replace('"sets"', '"set"'))
+        assert not multiplex.validated_input(str(input_file), str(tmp_path))[1]
+        assert self._run(argv, env).returncode == multiplex.EC_SCHEMA_FAIL
+        assert self._run(argv, env).returncode == multiplex.EC_SCHEMA_FAIL